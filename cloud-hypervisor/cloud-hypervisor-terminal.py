@@ -2,9 +2,10 @@ import asyncio
 import subprocess
 import os
 import signal
-import select
+import selectors
 import sys
 import argparse
+import atexit
 import uuid
 import time
 import json
@@ -12,48 +13,218 @@ import threading
 import tempfile
 import shutil
 import socket
+import collections
+import functools
+import itertools
+import re
+from dataclasses import dataclass
 from hypha_rpc import connect_to_server, login
 from fastapi import FastAPI
 from fastapi.responses import HTMLResponse, FileResponse
 from fastapi.staticfiles import StaticFiles
 
+# Marker written once network setup has completed; /run is cleared on reboot
+NETWORK_SETUP_SENTINEL = '/run/cloud-hypervisor-terminal.setup'
+
+# Most buffers a single writev accepts
+IOV_MAX = os.sysconf('SC_IOV_MAX')
+
+# VM startup script; extras holds the optional package install and custom script sections
+STARTUP_SCRIPT_TEMPLATE = """#!/bin/bash
+echo 'Cloud Hypervisor VM Starting...'
+echo 'VM Configuration:'
+echo '  CPUs: {cpus}'
+echo '  Memory: {memory}'
+echo '  Network: Available'
+echo ''
+{extras}
+echo 'Cloud Hypervisor VM ready!'
+echo 'Type commands to interact with the VM'
+"""
+
+@dataclass
+class Terminal:
+    """State of a single Cloud Hypervisor terminal session"""
+    # Declared by hand since dataclass(slots=True) needs Python 3.10
+    __slots__ = ('process', 'work_dir', 'session_uuid', 'vm_ip_suffix', 'created_at',
+                 'started_ns', 'user_id', 'running', 'pidfd', 'pgid', 'screen_buffer', 'pending_output',
+                 'output_ready', 'name', 'recipe', 'startup_script')
+    process: subprocess.Popen
+    work_dir: str
+    session_uuid: str
+    vm_ip_suffix: int
+    created_at: float  # wall-clock time, reported to clients
+    started_ns: int  # time.monotonic_ns() at creation, for elapsed-time math
+    user_id: str
+    running: bool
+    pidfd: int  # None when pidfd_open is unavailable
+    pgid: int
+    screen_buffer: collections.deque  # raw console output chunks, oldest dropped first
+    pending_output: list  # raw console output not yet returned by read_from_terminal
+    output_ready: threading.Condition  # guards the buffers, notified on new output
+    name: str
+    recipe: dict
+    startup_script: str
+
 class CloudHypervisorTerminal:
     def __init__(self):
         self.user_terminals = {}  # user_id -> {terminal_id -> terminal_data}
-        self.terminal_counter = 0
+        self._by_id = {}  # terminal_id -> terminal_data, same records indexed for O(1) lookup
+        self.terminal_counter = itertools.count()  # next() is atomic, so concurrent creates get distinct IDs
         self.base_dir = os.path.dirname(os.path.abspath(__file__))
+        # VM binaries and images never move, so resolve their paths once
+        bin_dir = os.path.join(self.base_dir, 'bin')
+        self.ch_binary = os.path.join(bin_dir, 'cloud-hypervisor')
+        self.kernel_path = os.path.join(bin_dir, 'vmlinux-ch')
+        self.firmware_path = os.path.join(bin_dir, 'hypervisor-fw')
+        self.rootfs_path = os.path.join(bin_dir, 'ubuntu-rootfs.img')
+        # Free VM IP suffixes on the TAP subnet (172.20.0.100-149)
+        self._ip_pool = set(range(100, 150))
+        self._ip_lock = threading.Lock()
+        self._default_iface = None
+        # Single selector watching every VM console and process; serviced by a background thread
+        self._selector = selectors.DefaultSelector()
+        self._reader_thread = threading.Thread(target=self._reader_loop, daemon=True)
+        self._reader_thread.start()
         self.cleanup_existing_vms()
         self.setup_network()
     
+    def _reader_loop(self):
+        """Dispatch console output and process exits as soon as the kernel reports them"""
+        while True:
+            for key, _ in self._selector.select():
+                handler, terminal = key.data
+                handler(key.fd, terminal)
+    
+    def _on_console_ready(self, fd, terminal):
+        """Drain VM console output into the terminal buffers"""
+        try:
+            output = os.read(fd, 65536)
+        except OSError:
+            output = b''
+        
+        if not output:
+            # EOF - the VM closed its console
+            self._unwatch_console(terminal)
+            if terminal.pidfd is None:
+                # No pidfd to tell us about the exit, console EOF is the best signal we have
+                terminal.running = False
+            return
+        
+        output_ready = terminal.output_ready
+        with output_ready:
+            terminal.pending_output.append(output)
+            # Store raw output in screen buffer for reconnection (oldest chunks drop off)
+            terminal.screen_buffer.append(output)
+            output_ready.notify_all()
+    
+    def _on_process_exit(self, fd, terminal):
+        """Mark the terminal as stopped once its Cloud Hypervisor process exits"""
+        terminal.running = False
+        self._release_pidfd(terminal)
+        with terminal.output_ready:
+            terminal.output_ready.notify_all()  # wake pattern waiters
+    
+    def _open_pidfd(self, pid):
+        """Open a pidfd that becomes readable when the process exits, if supported"""
+        try:
+            return os.pidfd_open(pid)
+        except (AttributeError, OSError):
+            # Requires Python 3.9+ on Linux 5.3+
+            return None
+    
+    def _watch_terminal(self, terminal):
+        """Start watching a terminal's console output and process exit"""
+        self._selector.register(terminal.process.stdout, selectors.EVENT_READ,
+                                (self._on_console_ready, terminal))
+        if terminal.pidfd is not None:
+            self._selector.register(terminal.pidfd, selectors.EVENT_READ,
+                                    (self._on_process_exit, terminal))
+    
+    def _unwatch_console(self, terminal):
+        """Stop watching a terminal's console output"""
+        try:
+            self._selector.unregister(terminal.process.stdout)
+        except (KeyError, ValueError):
+            pass
+    
+    def _release_pidfd(self, terminal):
+        """Stop watching a terminal's process and close its pidfd"""
+        with terminal.output_ready:
+            pidfd, terminal.pidfd = terminal.pidfd, None
+        if pidfd is not None:
+            try:
+                self._selector.unregister(pidfd)
+            except (KeyError, ValueError):
+                pass
+            os.close(pidfd)
+    
     def cleanup_existing_vms(self):
         """Clean up any existing Cloud Hypervisor VMs that might be using the TAP interface"""
         try:
-            # Find and kill any existing cloud-hypervisor processes
-            result = subprocess.run(['pgrep', '-f', 'cloud-hypervisor.*ch-tap0'], 
-                                  capture_output=True, text=True)
-            if result.returncode == 0:
-                pids = result.stdout.strip().split('\n')
-                cleaned_count = 0
-                for pid in pids:
-                    if pid.strip():
-                        try:
-                            subprocess.run(['kill', pid.strip()], check=True)
-                            print(f"Cleaned up existing Cloud Hypervisor VM (PID: {pid.strip()})")
-                            cleaned_count += 1
-                        except:
-                            pass
-                
-                if cleaned_count > 0:
-                    print(f"✅ Cleaned up {cleaned_count} existing Cloud Hypervisor processes")
-                    # Wait longer for processes to clean up and release TAP interface
+            # Find any existing cloud-hypervisor processes attached to ch-tap0 by scanning /proc
+            pids = []
+            for entry in os.scandir('/proc'):
+                if not entry.name.isdigit():
+                    continue
+                try:
+                    with open(f'/proc/{entry.name}/cmdline', 'rb') as f:
+                        cmdline = f.read()
+                except OSError:
+                    continue
+                binary_idx = cmdline.find(b'cloud-hypervisor')
+                if binary_idx != -1 and b'ch-tap0' in cmdline[binary_idx:]:
+                    pids.append(int(entry.name))
+            
+            cleaned_count = 0
+            pidfds = []
+            for pid in pids:
+                # Open the pidfd before signalling so a recycled PID can't be mistaken for the VM
+                pidfd = self._open_pidfd(pid)
+                try:
+                    os.kill(pid, signal.SIGTERM)
+                except OSError:
+                    if pidfd is not None:
+                        os.close(pidfd)
+                    continue
+                print(f"Cleaned up existing Cloud Hypervisor VM (PID: {pid})")
+                cleaned_count += 1
+                if pidfd is not None:
+                    pidfds.append(pidfd)
+            
+            if cleaned_count > 0:
+                print(f"✅ Cleaned up {cleaned_count} existing Cloud Hypervisor processes")
+                # Wait for processes to exit and release TAP interface
+                if len(pidfds) == cleaned_count:
+                    self._wait_for_pidfds(pidfds, timeout=3)
+                else:
                     time.sleep(3)
+                for pidfd in pidfds:
+                    os.close(pidfd)
             else:
                 print("ℹ️  No existing Cloud Hypervisor processes found")
         except:
             pass
     
+    def _wait_for_pidfds(self, pidfds, timeout):
+        """Wait until every process behind the given pidfds has exited, or the timeout passes"""
+        deadline = time.monotonic() + timeout
+        with selectors.DefaultSelector() as exit_selector:
+            for pidfd in pidfds:
+                exit_selector.register(pidfd, selectors.EVENT_READ)
+            while exit_selector.get_map():
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                for key, _ in exit_selector.select(timeout=remaining):
+                    exit_selector.unregister(key.fd)
+    
     def setup_network(self):
         """Setup network infrastructure for VMs"""
+        if self._network_setup_done():
+            print("Network already configured: TAP interface ch-tap0 set up since boot")
+            return
+        
         try:
             # Check if TAP interface already exists
             result = subprocess.run(['ip', 'link', 'show', 'ch-tap0'], 
@@ -61,51 +232,83 @@ class CloudHypervisorTerminal:
             if result.returncode != 0:
                 print("Setting up network infrastructure...")
                 
-                # Create TAP interface
-                subprocess.run(['sudo', 'ip', 'tuntap', 'add', 'dev', 'ch-tap0', 'mode', 'tap'], 
-                              check=True)
-                
-                # Configure TAP interface
-                subprocess.run(['sudo', 'ip', 'addr', 'add', '172.20.0.1/24', 'dev', 'ch-tap0'], 
-                              check=True)
-                subprocess.run(['sudo', 'ip', 'link', 'set', 'dev', 'ch-tap0', 'up'], 
-                              check=True)
+                # Create and configure TAP interface in a single ip invocation
+                subprocess.run(['sudo', 'ip', '-batch', '-'],
+                              input=("tuntap add dev ch-tap0 mode tap\n"
+                                     "addr add 172.20.0.1/24 dev ch-tap0\n"
+                                     "link set dev ch-tap0 up\n"),
+                              text=True, check=True)
                 
                 # Enable IP forwarding
                 subprocess.run(['sudo', 'sysctl', '-w', 'net.ipv4.ip_forward=1'], 
                               check=True)
                 
-                # Setup NAT (find default interface)
+                # Setup NAT (find default interface), loading all rules in one transaction
                 default_iface = self.get_default_interface()
                 if default_iface:
-                    subprocess.run(['sudo', 'iptables', '-t', 'nat', '-A', 'POSTROUTING', 
-                                   '-o', default_iface, '-j', 'MASQUERADE'], check=True)
-                    subprocess.run(['sudo', 'iptables', '-A', 'FORWARD', '-i', 'ch-tap0', 
-                                   '-o', default_iface, '-j', 'ACCEPT'], check=True)
-                    subprocess.run(['sudo', 'iptables', '-A', 'FORWARD', '-i', default_iface, 
-                                   '-o', 'ch-tap0', '-j', 'ACCEPT'], check=True)
+                    rules = (
+                        "*nat\n"
+                        f"-A POSTROUTING -o {default_iface} -j MASQUERADE\n"
+                        "COMMIT\n"
+                        "*filter\n"
+                        f"-A FORWARD -i ch-tap0 -o {default_iface} -j ACCEPT\n"
+                        f"-A FORWARD -i {default_iface} -o ch-tap0 -j ACCEPT\n"
+                        "COMMIT\n"
+                    )
+                    subprocess.run(['sudo', 'iptables-restore', '--noflush'],
+                                  input=rules, text=True, check=True)
                 
                 print("Network setup complete: TAP interface ch-tap0 ready")
             else:
                 print("Network already configured: TAP interface ch-tap0 exists")
+            self._mark_network_setup_done()
         except Exception as e:
             print(f"Warning: Network setup failed: {e}")
             print("VMs may not have network connectivity")
     
+    def _network_setup_done(self):
+        """Check whether network setup already ran since boot and ch-tap0 is still present"""
+        try:
+            setup_time = os.stat(NETWORK_SETUP_SENTINEL).st_mtime
+        except OSError:
+            return False
+        return setup_time > self._boot_time() and os.access('/sys/class/net/ch-tap0', os.F_OK)
+    
+    def _mark_network_setup_done(self):
+        """Record that network setup completed so later instances can skip it"""
+        try:
+            with open(NETWORK_SETUP_SENTINEL, 'w'):
+                pass
+        except OSError:
+            # /run is usually root-only; without the sentinel the checks simply run again
+            pass
+    
+    def _boot_time(self):
+        """Get the system boot time (seconds since the epoch) from /proc/stat"""
+        try:
+            with open('/proc/stat') as f:
+                for line in f:
+                    if line.startswith('btime '):
+                        return int(line.split()[1])
+        except OSError:
+            pass
+        return 0
+    
     def get_default_interface(self):
-        """Get the default network interface"""
+        """Get the default network interface (cached once found)"""
+        if self._default_iface:
+            return self._default_iface
         try:
-            result = subprocess.run(['ip', 'route', 'show', 'default'], 
-                                  capture_output=True, text=True, check=True)
-            # Parse output to find default interface
-            for line in result.stdout.split('\n'):
-                if 'default' in line:
+            # Read the routing table directly instead of spawning `ip route`
+            with open('/proc/net/route') as f:
+                next(f)  # Skip header
+                for line in f:
                     parts = line.split()
-                    if 'dev' in parts:
-                        idx = parts.index('dev')
-                        if idx + 1 < len(parts):
-                            return parts[idx + 1]
-        except:
+                    # Default route: destination and mask are both 0.0.0.0
+                    if len(parts) > 7 and parts[1] == '00000000' and parts[7] == '00000000':
+                        self._default_iface = parts[0]
+                        return self._default_iface
+        except (OSError, StopIteration):
             pass
         return None
     
@@ -118,18 +321,21 @@ class CloudHypervisorTerminal:
         print(f"DEBUG: use_firmware = {use_firmware} (type: {type(use_firmware)})")
         
         # Generate unique terminal ID and session UUID
-        terminal_id = f"terminal_{self.terminal_counter}"
-        self.terminal_counter += 1
+        terminal_index = next(self.terminal_counter)
+        terminal_id = f"terminal_{terminal_index}"
+        terminal_number = terminal_index + 1
         session_uuid = str(uuid.uuid4())
         
         # Create unique working directory for this terminal session
         work_dir = os.path.join(self.base_dir, f"vm-{session_uuid}")
         os.makedirs(work_dir, exist_ok=True)
+        vm_ip_suffix = None
         
         try:
             # Configure VM parameters
             vm_config = self._prepare_vm_config(recipe or {}, work_dir, session_uuid)
             vm_config['session_uuid'] = session_uuid  # Add session UUID for unique network config
+            vm_ip_suffix = vm_config['vm_ip_suffix'] = self._allocate_vm_ip(session_uuid)
             
             # Build Cloud Hypervisor command
             ch_cmd = self._build_cloud_hypervisor_command(vm_config)
@@ -145,17 +351,28 @@ class CloudHypervisorTerminal:
                 stdout=subprocess.PIPE,
                 stderr=subprocess.STDOUT,
                 stdin=subprocess.PIPE,
-                preexec_fn=os.setsid,
+                start_new_session=True,
                 bufsize=0,
                 cwd=work_dir
             )
             
-            # Wait for VM to start and check if it's running
-            time.sleep(2)
+            # Wait (at most 2 seconds) for the VM to either write to its console or exit
+            pidfd = self._open_pidfd(ch_process.pid)
+            with selectors.DefaultSelector() as startup_selector:
+                startup_selector.register(ch_process.stdout, selectors.EVENT_READ)
+                if pidfd is not None:
+                    startup_selector.register(pidfd, selectors.EVENT_READ)
+                events = startup_selector.select(timeout=2)
+                if pidfd is not None and events and all(key.fd != pidfd for key, _ in events):
+                    # Console output came first; a failing VM exits right after printing its error
+                    startup_selector.unregister(ch_process.stdout)
+                    startup_selector.select(timeout=0.1)
             
             if ch_process.poll() is not None:
+                if pidfd is not None:
+                    os.close(pidfd)
                 # Process ended immediately, check output
-                output = ch_process.stdout.read(1024).decode('utf-8', errors='replace')
+                output = self._drain_exit_output(ch_process)
                 
                 # Check for specific error types
                 if "Resource busy" in output:
@@ -165,62 +382,88 @@ class CloudHypervisorTerminal:
                 else:
                     raise Exception(f"Error booting VM: {output}")
             
-            # Initialize user terminals if not exists
-            if user_id not in self.user_terminals:
-                self.user_terminals[user_id] = {}
+            terminal_name = recipe.get('name', f'CloudHV {terminal_number}') if recipe else f'CloudHV {terminal_number}'
             
-            terminal_name = recipe.get('name', f'CloudHV {self.terminal_counter}') if recipe else f'CloudHV {self.terminal_counter}'
-            
-            self.user_terminals[user_id][terminal_id] = {
-                'process': ch_process,
-                'work_dir': work_dir,
-                'session_uuid': session_uuid,
-                'created_at': time.time(),
-                'user_id': user_id,
-                'screen_buffer': [],
-                'name': terminal_name,
-                'recipe': recipe or {},
-                'startup_script': startup_script
-            }
+            terminal = Terminal(
+                process=ch_process,
+                work_dir=work_dir,
+                session_uuid=session_uuid,
+                vm_ip_suffix=vm_ip_suffix,
+                created_at=time.time(),
+                started_ns=time.monotonic_ns(),
+                user_id=user_id,
+                running=True,
+                pidfd=pidfd,
+                pgid=os.getpgid(ch_process.pid),
+                screen_buffer=collections.deque(maxlen=1000),
+                pending_output=[],
+                output_ready=threading.Condition(),
+                name=terminal_name,
+                recipe=recipe or {},
+                startup_script=startup_script
+            )
+            # setdefault so concurrent first creates for one user don't replace each other's dict
+            self.user_terminals.setdefault(user_id, {})[terminal_id] = terminal
+            self._by_id[terminal_id] = terminal
+            self._watch_terminal(terminal)
             
             return {"terminal_id": terminal_id, "success": True, "name": terminal_name}
             
         except Exception as e:
             # Clean up on error
-            if os.path.exists(work_dir):
-                shutil.rmtree(work_dir)
+            self._release_vm_ip(vm_ip_suffix)
+            shutil.rmtree(work_dir, ignore_errors=True)
             return {"error": str(e), "success": False}
     
+    async def create_terminal_async(self, recipe=None, user_id=None):
+        """Create a terminal on a worker thread so the event loop stays responsive during VM startup"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, self.create_terminal, recipe, user_id)
+    
+    def _drain_exit_output(self, process, limit=8192):
+        """Collect the last `limit` bytes a VM wrote before exiting, without blocking"""
+        fd = process.stdout.fileno()
+        os.set_blocking(fd, False)
+        tail = bytearray()
+        while True:
+            try:
+                chunk = os.read(fd, 65536)
+            except BlockingIOError:
+                break
+            if not chunk:
+                break
+            tail += chunk
+            del tail[:-limit]
+        return tail.decode('utf-8', errors='replace')
+    
     def _create_startup_script(self, work_dir, recipe):
         """Create a startup script for the VM"""
         startup_script = os.path.join(work_dir, "startup.sh")
         
-        script_content = "#!/bin/bash\n"
-        script_content += "echo 'Cloud Hypervisor VM Starting...'\n"
-        script_content += "echo 'VM Configuration:'\n"
-        script_content += f"echo '  CPUs: {recipe.get('cpus', 2)}'\n"
-        script_content += f"echo '  Memory: {recipe.get('memory', '512M')}'\n"
-        script_content += "echo '  Network: Available'\n"
-        script_content += "echo ''\n"
+        extras = ""
         
         # Add Python package installation if specified
         if recipe.get('python_packages'):
-            script_content += "echo 'Installing Python packages...'\n"
             packages = ' '.join(recipe['python_packages'])
-            script_content += f"pip install {packages}\n"
+            extras += f"echo 'Installing Python packages...'\npip install {packages}\n"
         
         # Add custom startup script if specified
         if recipe.get('startup_script'):
-            script_content += "\n# Custom startup script\n"
-            script_content += recipe['startup_script'] + "\n"
+            extras += f"\n# Custom startup script\n{recipe['startup_script']}\n"
         
-        script_content += "\necho 'Cloud Hypervisor VM ready!'\n"
-        script_content += "echo 'Type commands to interact with the VM'\n"
+        script_content = STARTUP_SCRIPT_TEMPLATE.format(
+            cpus=recipe.get('cpus', 2),
+            memory=recipe.get('memory', '512M'),
+            extras=extras
+        )
         
-        with open(startup_script, 'w') as f:
-            f.write(script_content)
+        # Create the script executable in one go instead of write + chmod
+        fd = os.open(startup_script, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o755)
+        try:
+            os.write(fd, script_content.encode())
+        finally:
+            os.close(fd)
         
-        os.chmod(startup_script, 0o755)
         return startup_script
     
     def _prepare_vm_config(self, recipe, work_dir, session_uuid):
@@ -238,23 +481,21 @@ class CloudHypervisorTerminal:
         # Choose boot method - default to direct kernel boot since it works with our rootfs
         if recipe.get('use_firmware', False):
             # Use firmware boot (UEFI) - requires EFI bootable disk
-            config['kernel'] = os.path.join(self.base_dir, 'bin', 'hypervisor-fw')
+            config['kernel'] = self.firmware_path
         else:
             # Use direct kernel boot (default) - works with raw ext4 filesystem
-            config['kernel'] = os.path.join(self.base_dir, 'bin', 'vmlinux-ch')
+            config['kernel'] = self.kernel_path
             config['cmdline'] = 'console=ttyS0 root=/dev/vda1 rw'
         
         # Use existing rootfs (custom disk creation can be added later)
-        config['disk'] = os.path.join(self.base_dir, 'bin', 'ubuntu-rootfs.img')
+        config['disk'] = self.rootfs_path
         
         return config
     
     def _build_cloud_hypervisor_command(self, config):
         """Build Cloud Hypervisor command line"""
-        ch_binary = os.path.join(self.base_dir, 'bin', 'cloud-hypervisor')
-        
         cmd = [
-            ch_binary,
+            self.ch_binary,
             '--cpus', f'boot={config["cpus"]}',
             '--memory', f'size={config["memory"]}',
             '--kernel', config['kernel'],
@@ -269,50 +510,80 @@ class CloudHypervisorTerminal:
         
         # Add networking if enabled
         if config.get('net'):
-            # Generate random MAC address for this VM
-            mac = self._generate_mac_address()
-            # Use unique IP for each VM
-            vm_ip = f"172.20.0.{100 + (hash(config.get('session_uuid', '')) % 50)}"
+            # Derive MAC address from the session UUID
+            mac = self._generate_mac_address(config['session_uuid'])
+            # Use the IP reserved for this VM
+            vm_ip = f"172.20.0.{config['vm_ip_suffix']}"
             cmd.extend(['--net', f'tap=ch-tap0,mac={mac},ip={vm_ip},mask=255.255.255.0'])
         
         return cmd
     
-    def _generate_mac_address(self):
-        """Generate a random MAC address for the VM"""
-        import random
+    def _generate_mac_address(self, session_uuid):
+        """Generate a MAC address for the VM from its session UUID"""
+        uuid_bytes = uuid.UUID(session_uuid).bytes
         # Use locally administered MAC address range
         mac = [0x02, 0x00, 0x00,
-               random.randint(0x00, 0x7f),
-               random.randint(0x00, 0xff),
-               random.randint(0x00, 0xff)]
+               uuid_bytes[0] & 0x7f,
+               uuid_bytes[1],
+               uuid_bytes[2]]
         return ':'.join(map(lambda x: "%02x" % x, mac))
     
+    def _allocate_vm_ip(self, session_uuid):
+        """Reserve an IP suffix for a VM, preferring the one derived from its session UUID"""
+        preferred = 100 + uuid.UUID(session_uuid).int % 50
+        with self._ip_lock:
+            if preferred in self._ip_pool:
+                suffix = preferred
+            elif self._ip_pool:
+                suffix = min(self._ip_pool)
+            else:
+                raise Exception("No free VM IP addresses left on ch-tap0")
+            self._ip_pool.remove(suffix)
+        return suffix
+    
+    def _release_vm_ip(self, suffix):
+        """Return a VM IP suffix to the pool"""
+        if suffix is not None:
+            with self._ip_lock:
+                self._ip_pool.add(suffix)
+    
     def _find_terminal(self, terminal_id, user_id=None):
         """Find terminal by ID, optionally restricted to a specific user"""
-        if user_id:
-            if user_id in self.user_terminals and terminal_id in self.user_terminals[user_id]:
-                return self.user_terminals[user_id][terminal_id]
-        else:
-            # Search across all users
-            for user_terminals in self.user_terminals.values():
-                if terminal_id in user_terminals:
-                    return user_terminals[terminal_id]
-        return None
+        terminal = self._by_id.get(terminal_id)
+        if terminal is None or (user_id and terminal.user_id != user_id):
+            return None
+        return terminal
     
     def write_to_terminal(self, terminal_id, command, user_id=None):
+        return self.write_many_to_terminal(terminal_id, [command], user_id)
+    
+    def write_many_to_terminal(self, terminal_id, commands, user_id=None):
+        """Write several commands to the VM console with a single vectored write"""
         terminal = self._find_terminal(terminal_id, user_id)
         if not terminal:
             return {"error": "Terminal not found", "success": False}
         
         try:
             # Check if process is still running
-            if terminal['process'].poll() is not None:
+            if not terminal.running:
                 return {"error": "VM process has stopped", "success": False}
             
             # Write to the Cloud Hypervisor process stdin (VM console input)
-            if terminal['process'].stdin and not terminal['process'].stdin.closed:
-                terminal['process'].stdin.write(command.encode())
-                terminal['process'].stdin.flush()
+            stdin = terminal.process.stdin
+            if stdin and not stdin.closed:
+                fd = stdin.fileno()
+                parts = [command.encode() for command in commands if command]
+                while parts:
+                    batch = parts[:IOV_MAX]
+                    written = os.writev(fd, batch)
+                    # A pipe write can be partial; drop what went out and resume mid-buffer
+                    consumed = 0
+                    while consumed < len(batch) and written >= len(batch[consumed]):
+                        written -= len(batch[consumed])
+                        consumed += 1
+                    del parts[:consumed]
+                    if written:
+                        parts[0] = parts[0][written:]
                 return {"success": True}
             else:
                 return {"error": "Process stdin not available", "success": False}
@@ -326,69 +597,102 @@ class CloudHypervisorTerminal:
         
         try:
             # Check if process is alive
-            if terminal['process'].poll() is not None:
+            if not terminal.running:
                 return {"error": "VM process has stopped", "success": False}
             
-            # Use select for non-blocking read from stdout (VM console output)
-            process = terminal['process']
-            if process.stdout and not process.stdout.closed:
-                ready, _, _ = select.select([process.stdout], [], [], 0.1)
-                
-                if ready:
-                    try:
-                        output = os.read(process.stdout.fileno(), 4096)
-                        if output:
-                            decoded_output = output.decode('utf-8', errors='replace')
-                            # Store output in screen buffer for reconnection
-                            terminal['screen_buffer'].append(decoded_output)
-                            # Keep buffer size reasonable
-                            if len(terminal['screen_buffer']) > 1000:
-                                terminal['screen_buffer'] = terminal['screen_buffer'][-1000:]
-                            return {"output": decoded_output, "success": True}
-                    except OSError:
-                        pass
+            # Hand over whatever the reader thread collected, waiting briefly if nothing yet
+            output_ready = terminal.output_ready
+            pending_output = terminal.pending_output
+            with output_ready:
+                if not pending_output:
+                    output_ready.wait(0.1)
+                output = b''.join(pending_output)
+                pending_output.clear()
             
-            return {"output": "", "success": True}
+            return {"output": output.decode('utf-8', errors='replace'), "success": True}
         except Exception as e:
             return {"error": str(e), "success": False}
     
+    def wait_for_pattern(self, terminal_id, patterns, timeout=30, user_id=None):
+        """Consume console output until one of patterns (case-insensitive) appears or timeout expires"""
+        terminal = self._find_terminal(terminal_id, user_id)
+        if not terminal:
+            return {"error": "Terminal not found", "success": False}
+        
+        encoded = [p.encode() if isinstance(p, str) else p for p in patterns]
+        regex = re.compile(b'|'.join(re.escape(p) for p in encoded), re.IGNORECASE)
+        overlap = max(map(len, encoded)) - 1  # a match may straddle two chunks
+        seen = bytearray()
+        searched = 0
+        match = None
+        deadline = time.monotonic() + timeout
+        
+        output_ready = terminal.output_ready
+        pending_output = terminal.pending_output
+        with output_ready:
+            while True:
+                for chunk in pending_output:
+                    seen += chunk
+                pending_output.clear()
+                match = regex.search(seen, max(0, searched - overlap))
+                searched = len(seen)
+                if match or not terminal.running:
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                output_ready.wait(remaining)
+        
+        return {
+            "matched": match.group(0).decode('utf-8', errors='replace') if match else None,
+            "output": seen.decode('utf-8', errors='replace'),
+            "success": True
+        }
+    
+    async def wait_for_pattern_async(self, terminal_id, patterns, timeout=30, user_id=None):
+        """Wait for a console pattern on a worker thread so the event loop keeps running"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, self.wait_for_pattern, terminal_id, patterns, timeout, user_id)
+    
     def close_terminal(self, terminal_id, user_id=None):
         terminal = self._find_terminal(terminal_id, user_id)
         if not terminal:
             return {"error": "Terminal not found", "success": False}
         
+        self._unwatch_console(terminal)
+        self._release_pidfd(terminal)
+        
         try:
             # Kill the Cloud Hypervisor process
-            process = terminal['process']
+            process = terminal.process
             if process.poll() is None:  # Process is still running
-                os.killpg(os.getpgid(process.pid), signal.SIGTERM)
+                os.killpg(terminal.pgid, signal.SIGTERM)
                 
                 # Wait a moment for graceful termination
                 time.sleep(1)
                 
                 # Force kill if still running
                 if process.poll() is None:
-                    os.killpg(os.getpgid(process.pid), signal.SIGKILL)
+                    os.killpg(terminal.pgid, signal.SIGKILL)
             
             # Clean up working directory
-            if os.path.exists(terminal['work_dir']):
-                shutil.rmtree(terminal['work_dir'])
+            shutil.rmtree(terminal.work_dir, ignore_errors=True)
         except Exception as e:
             print(f"Warning: Error during terminal cleanup: {e}")
         
-        # Remove from user's terminals
-        if user_id and user_id in self.user_terminals:
-            if terminal_id in self.user_terminals[user_id]:
-                del self.user_terminals[user_id][terminal_id]
-        else:
-            # Find and remove from any user
-            for user_terminals in self.user_terminals.values():
-                if terminal_id in user_terminals:
-                    del user_terminals[terminal_id]
-                    break
+        self._release_vm_ip(terminal.vm_ip_suffix)
+        
+        # Remove from user's terminals and the ID index
+        self._by_id.pop(terminal_id, None)
+        self.user_terminals[terminal.user_id].pop(terminal_id, None)
         
         return {"success": True}
     
+    async def close_terminal_async(self, terminal_id, user_id=None):
+        """Close a terminal on a worker thread since shutdown waits for the VM to exit"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, self.close_terminal, terminal_id, user_id)
+    
     def resize_terminal(self, terminal_id, rows, cols, user_id=None):
         terminal = self._find_terminal(terminal_id, user_id)
         if not terminal:
@@ -408,9 +712,9 @@ class CloudHypervisorTerminal:
                 for tid, tdata in self.user_terminals[user_id].items():
                     terminals.append({
                         'id': tid,
-                        'name': tdata['name'],
-                        'created': tdata['created_at'],
-                        'status': 'running' if tdata['process'].poll() is None else 'stopped'
+                        'name': tdata.name,
+                        'created': tdata.created_at,
+                        'status': 'running' if tdata.running else 'stopped'
                     })
                 return {"terminals": terminals, "success": True}
             else:
@@ -418,14 +722,13 @@ class CloudHypervisorTerminal:
         else:
             # Return all terminals across all users
             all_terminals = []
-            for user_terminals in self.user_terminals.values():
-                for tid, tdata in user_terminals.items():
-                    all_terminals.append({
-                        'id': tid,
-                        'name': tdata['name'],
-                        'created': tdata['created_at'],
-                        'status': 'running' if tdata['process'].poll() is None else 'stopped'
-                    })
+            for tid, tdata in self._by_id.items():
+                all_terminals.append({
+                    'id': tid,
+                    'name': tdata.name,
+                    'created': tdata.created_at,
+                    'status': 'running' if tdata.running else 'stopped'
+                })
             return {"terminals": all_terminals, "success": True}
     
     def get_screen_content(self, terminal_id, user_id=None):
@@ -435,8 +738,9 @@ class CloudHypervisorTerminal:
         
         try:
             # Return the accumulated screen buffer
-            screen_content = ''.join(terminal['screen_buffer'])
-            return {"content": screen_content, "success": True}
+            with terminal.output_ready:
+                screen_content = b''.join(terminal.screen_buffer)
+            return {"content": screen_content.decode('utf-8', errors='replace'), "success": True}
         except Exception as e:
             return {"error": str(e), "success": False}
     
@@ -449,12 +753,13 @@ class CloudHypervisorTerminal:
         try:
             status = {
                 'id': terminal_id,
-                'name': terminal['name'],
-                'created': terminal['created_at'],
-                'running': terminal['process'].poll() is None,
-                'pid': terminal['process'].pid,
-                'recipe': terminal['recipe'],
-                'work_dir': terminal['work_dir']
+                'name': terminal.name,
+                'created': terminal.created_at,
+                'uptime': (time.monotonic_ns() - terminal.started_ns) / 1e9,
+                'running': terminal.running,
+                'pid': terminal.process.pid,
+                'recipe': terminal.recipe,
+                'work_dir': terminal.work_dir
             }
             return {"status": status, "success": True}
         except Exception as e:
@@ -470,7 +775,7 @@ app = FastAPI()
 terminal_service_id = None
 
 # Global variable to store authorized users
-authorized_users = set()
+authorized_users = frozenset()
 
 @app.get("/", response_class=HTMLResponse)
 async def serve_index():
@@ -501,6 +806,59 @@ async def serve_static(args, context=None):
         print(f'{context["user"]["id"]} - {scope["client"]} - {scope["method"]} - {scope["path"]}')
     await app(args["scope"], args["receive"], args["send"])
 
+# Boot milestones reported by the Test 5 root device probes, one named group each
+DEBUG_PROBE_RE = re.compile(
+    rb'(?P<root_error>VFS: Cannot open root device)|(?P<root_mounted>VFS: Mounted root)'
+    rb'|(?P<panic>Kernel panic)|(?P<init>init: /init)')
+DEBUG_PROBE_MESSAGES = {
+    'root_error': "❌ Root device error",
+    'root_mounted': "✅ Root mounted",
+    'panic': "❌ Kernel panic",
+    'init': "✅ Init started",
+}
+
+def snapshot_bin(bin_dir):
+    """Stat every entry of bin_dir once, keyed by file name"""
+    snapshot = {}
+    try:
+        with os.scandir(bin_dir) as entries:
+            for entry in entries:
+                try:
+                    snapshot[entry.name] = entry.stat()
+                except FileNotFoundError:
+                    pass  # dangling symlink counts as missing
+    except FileNotFoundError:
+        pass
+    return snapshot
+
+# Descriptor for /proc/sys/net/ipv4/ip_forward, opened on first use
+_ip_forward_fd = None
+
+def ip_forward_enabled():
+    """Read the IPv4 forwarding flag through a descriptor that stays open for the process lifetime"""
+    global _ip_forward_fd
+    if _ip_forward_fd is None:
+        _ip_forward_fd = os.open('/proc/sys/net/ipv4/ip_forward', os.O_RDONLY)
+        atexit.register(os.close, _ip_forward_fd)
+    return os.pread(_ip_forward_fd, 2, 0).startswith(b'1')
+
+async def wait_tap_released(name='ch-tap0', max_wait=3.0):
+    """Wait until no VM holds the TAP interface; its carrier drops once the last fd is closed"""
+    carrier_path = f'/sys/class/net/{name}/carrier'
+    deadline = time.monotonic() + max_wait
+    delay = 0.05
+    while True:
+        try:
+            with open(carrier_path) as f:
+                if f.read().strip() != '1':
+                    return True
+        except OSError:
+            return True  # interface is gone or administratively down
+        if time.monotonic() >= deadline:
+            return False
+        await asyncio.sleep(delay)
+        delay = min(delay * 2, 0.4)
+
 async def test_mode():
     """Test mode for automated VM testing"""
     print("🧪 Cloud Hypervisor Test Mode")
@@ -510,18 +868,30 @@ async def test_mode():
     print("🧹 Cleaning up existing processes...")
     try:
         # Be specific - only kill the binary, not Python scripts
-        result = subprocess.run(['pkill', '-f', '/bin/cloud-hypervisor'], 
-                              capture_output=True, text=True)
-        if result.returncode == 0:
+        proc = await asyncio.create_subprocess_exec(
+            'pkill', '-f', '/bin/cloud-hypervisor',
+            stdout=asyncio.subprocess.DEVNULL, stderr=asyncio.subprocess.DEVNULL)
+        if await proc.wait() == 0:
             print("✅ Cleaned up existing Cloud Hypervisor processes")
         else:
             print("ℹ️  No existing Cloud Hypervisor processes found")
-        time.sleep(2)  # Wait for cleanup
+        await wait_tap_released()  # Wait for cleanup
     except Exception as e:
         print(f"⚠️  Cleanup warning: {e}")
     
-    # Initialize terminal manager
-    terminal_manager = CloudHypervisorTerminal()
+    # Initialize terminal manager off the event loop; it cleans up old VMs and configures networking
+    loop = asyncio.get_running_loop()
+    terminal_manager = await loop.run_in_executor(None, CloudHypervisorTerminal)
+    bin_dir = os.path.dirname(terminal_manager.ch_binary)
+    bin_snapshot = snapshot_bin(bin_dir)
+    # Minimal direct-boot argv shared by the Test 5 and Test 6 VMs
+    boot_args = [
+        terminal_manager.ch_binary,
+        '--cpus', 'boot=1',
+        '--memory', 'size=256M',
+        '--kernel', terminal_manager.kernel_path,
+        '--disk', f'path={terminal_manager.rootfs_path}',
+    ]
     
     print("✅ Network setup completed")
     print("📋 Starting VM tests...")
@@ -538,7 +908,7 @@ async def test_mode():
         'startup_script': ''
     }
     
-    result = terminal_manager.create_terminal(default_ui_recipe, "test_user")
+    result = await terminal_manager.create_terminal_async(default_ui_recipe, "test_user")
     if not result['success']:
         print(f"❌ Default UI config failed: {result['error']}")
         return False
@@ -547,21 +917,17 @@ async def test_mode():
     print(f"✅ Default UI config VM created: {terminal_id}")
     
     # Test boot for 10 seconds
-    start_time = time.time()
-    while time.time() - start_time < 10:
-        read_result = terminal_manager.read_from_terminal(terminal_id, "test_user")
-        if read_result['success'] and read_result['output']:
-            output = read_result['output']
-            if "panic" in output.lower() or "error" in output.lower():
-                print(f"❌ Default UI config boot failed: {output[:200]}...")
-                break
-            elif "linux version" in output.lower():
-                print("✅ Default UI config: Linux kernel loading successfully")
-                break
-        time.sleep(1)
+    wait_result = await terminal_manager.wait_for_pattern_async(
+        terminal_id, ["panic", "error", "linux version"], 10, "test_user")
+    if wait_result['success'] and wait_result['matched']:
+        output = wait_result['output']
+        if wait_result['matched'].lower() == "linux version":
+            print("✅ Default UI config: Linux kernel loading successfully")
+        else:
+            print(f"❌ Default UI config boot failed: {output[:200]}...")
     
     # Cleanup default test VM
-    terminal_manager.close_terminal(terminal_id, "test_user")
+    await terminal_manager.close_terminal_async(terminal_id, "test_user")
     
     # Test 2: Basic VM Creation with explicit settings
     print("\n🔧 Test 2: Explicit Direct Boot Test")
@@ -574,7 +940,7 @@ async def test_mode():
         'startup_script': 'echo "VM Test Started"'
     }
     
-    result = terminal_manager.create_terminal(test_recipe, "test_user")
+    result = await terminal_manager.create_terminal_async(test_recipe, "test_user")
     if not result['success']:
         print(f"❌ VM creation failed: {result['error']}")
         return False
@@ -585,31 +951,26 @@ async def test_mode():
     # Test 2: Monitor VM Boot Process
     print("\n🚀 Test 2: Monitoring VM Boot Process")
     boot_timeout = 30  # seconds
-    start_time = time.time()
     
-    while time.time() - start_time < boot_timeout:
-        read_result = terminal_manager.read_from_terminal(terminal_id, "test_user")
-        if read_result['success'] and read_result['output']:
-            output = read_result['output']
-            print(f"📺 VM Output: {output.strip()}")
-            
-            # Check for boot completion or errors
-            if "login:" in output.lower() or "# " in output or "$ " in output:
-                print("✅ VM boot appears successful - shell prompt detected")
-                break
-            elif "panic" in output.lower() or "error" in output.lower():
-                print(f"❌ VM boot error detected: {output}")
-                break
-        
-        time.sleep(1)
-    else:
+    # Check for boot completion or errors
+    wait_result = await terminal_manager.wait_for_pattern_async(
+        terminal_id, ["login:", "# ", "$ ", "panic", "error"], boot_timeout, "test_user")
+    matched = wait_result.get('matched')
+    if wait_result['success'] and wait_result['output']:
+        print(f"📺 VM Output: {wait_result['output'].strip()}")
+    if not matched:
         print("⚠️  VM boot monitoring timed out")
+    elif matched.lower() in ("panic", "error"):
+        print(f"❌ VM boot error detected: {wait_result['output']}")
+    else:
+        print("✅ VM boot appears successful - shell prompt detected")
     
     # Clean up Test 2 VM and wait for TAP interface to be released
     print("\n🧹 Cleaning up Test 2 VM...")
-    terminal_manager.close_terminal(terminal_id, "test_user")
+    await terminal_manager.close_terminal_async(terminal_id, "test_user")
     print("⏱️  Waiting for TAP interface to be released...")
-    time.sleep(3)  # Wait for TAP interface to be fully released
+    if not await wait_tap_released():
+        print("⚠️  TAP interface still in use after 3 seconds")
     
     # Test 3: Simulate UI Default Configuration (with no use_firmware field)
     print("\n🔧 Test 3: UI Default Config Simulation (mimicking browser localStorage)")
@@ -623,7 +984,7 @@ async def test_mode():
         'startup_script': ''
     }
     
-    result = terminal_manager.create_terminal(ui_default_recipe, "test_user")
+    result = await terminal_manager.create_terminal_async(ui_default_recipe, "test_user")
     if not result['success']:
         print(f"❌ UI default simulation failed: {result['error']}")
         return False
@@ -632,23 +993,19 @@ async def test_mode():
     print(f"✅ UI default simulation VM created: {ui_terminal_id}")
     
     # Test boot for 5 seconds
-    start_time = time.time()
-    while time.time() - start_time < 5:
-        read_result = terminal_manager.read_from_terminal(ui_terminal_id, "test_user")
-        if read_result['success'] and read_result['output']:
-            output = read_result['output']
-            if "panic" in output.lower() or "error" in output.lower():
-                print(f"❌ UI default simulation boot failed: {output[:200]}...")
-                break
-            elif "linux version" in output.lower():
-                print("✅ UI default simulation: Linux kernel loading successfully")
-                break
-        time.sleep(1)
+    wait_result = await terminal_manager.wait_for_pattern_async(
+        ui_terminal_id, ["panic", "error", "linux version"], 5, "test_user")
+    if wait_result['success'] and wait_result['matched']:
+        output = wait_result['output']
+        if wait_result['matched'].lower() == "linux version":
+            print("✅ UI default simulation: Linux kernel loading successfully")
+        else:
+            print(f"❌ UI default simulation boot failed: {output[:200]}...")
     
     # Cleanup
-    terminal_manager.close_terminal(ui_terminal_id, "test_user")
+    await terminal_manager.close_terminal_async(ui_terminal_id, "test_user")
     print("⏱️  Waiting for TAP interface cleanup...")
-    time.sleep(2)  # Wait for cleanup to complete
+    await wait_tap_released(max_wait=2.0)  # Wait for cleanup to complete
     
     # Test 4: VM Status Check
     print("\n📊 Test 4: VM Status Check")
@@ -664,72 +1021,72 @@ async def test_mode():
     # Test 5: Root Device Debug Test
     print("\n🔧 Test 5: Root Device Debug Test")
     debug_recipes = [
-        {'name': 'Debug VDA1', 'cmdline': 'console=ttyS0 root=/dev/vda1 rw'},
-        {'name': 'Debug VDA (whole disk)', 'cmdline': 'console=ttyS0 root=/dev/vda rw'},
-        {'name': 'Debug VDB1', 'cmdline': 'console=ttyS0 root=/dev/vdb1 rw'},
-        {'name': 'Debug VirtIO verbose', 'cmdline': 'console=ttyS0 root=/dev/vda1 rw debug loglevel=8'},
+        {'name': 'Debug VDA1', 'cmdline': 'console=ttyS0 root=/dev/vda1 ro'},
+        {'name': 'Debug VDA (whole disk)', 'cmdline': 'console=ttyS0 root=/dev/vda ro'},
+        {'name': 'Debug VDB1', 'cmdline': 'console=ttyS0 root=/dev/vdb1 ro'},
+        {'name': 'Debug VirtIO verbose', 'cmdline': 'console=ttyS0 root=/dev/vda1 ro debug loglevel=8'},
     ]
     
-    for recipe in debug_recipes:
-        print(f"\n🔍 Testing {recipe['name']} with cmdline: {recipe['cmdline']}")
-        
-        # Create a custom test VM with specific cmdline
-        test_cmd = [
-            os.path.join(terminal_manager.base_dir, 'bin', 'cloud-hypervisor'),
-            '--cpus', 'boot=1',
-            '--memory', 'size=256M',
-            '--kernel', os.path.join(terminal_manager.base_dir, 'bin', 'vmlinux-ch'),
-            '--disk', f'path={os.path.join(terminal_manager.base_dir, "bin", "ubuntu-rootfs.img")}',
-            '--console', 'off',
-            '--serial', 'tty',
-            '--cmdline', recipe['cmdline']
-        ]
+    # Build each probe's argv up front. The probes run together, so they must not share anything
+    # writable: no --net (ch-tap0 is single-user), and the rootfs attached read-only and mounted ro,
+    # since several kernels mounting one ext4 image read-write would corrupt it
+    if '--net' in boot_args:
+        raise ValueError("Concurrent boot probes can't share a network device")
+    probe_args = list(boot_args)
+    probe_args[probe_args.index('--disk') + 1] += ',readonly=on'
+    probe_cmds = [
+        tuple(probe_args + ['--console', 'off', '--serial', 'tty', '--cmdline', recipe['cmdline']])
+        for recipe in debug_recipes
+    ]
+    # Each probe VM takes one vCPU, so run at most one per host CPU at a time
+    probe_slots = asyncio.Semaphore(os.cpu_count() or 1)
+    
+    async def probe(recipe, test_cmd):
+        results = [f"\n🔍 Testing {recipe['name']} with cmdline: {recipe['cmdline']}"]
         
         try:
-            # Start the VM
-            proc = subprocess.Popen(test_cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
-            
-            # Monitor for 5 seconds
-            start_time = time.time()
-            output_lines = []
-            
-            while time.time() - start_time < 5:
-                if proc.poll() is not None:
-                    break
-                    
-                line = proc.stdout.readline()
-                if line:
-                    output_lines.append(line.strip())
+            async with probe_slots:
+                # Start the VM; stderr is never read, so don't let it fill a pipe
+                proc = await asyncio.create_subprocess_exec(
+                    *test_cmd, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.DEVNULL)
+                
+                # Monitor for 5 seconds
+                deadline = loop.time() + 5
+                
+                while True:
+                    try:
+                        raw = await asyncio.wait_for(proc.stdout.readline(), timeout=deadline - loop.time())
+                    except asyncio.TimeoutError:
+                        break
+                    if not raw:
+                        break  # VM exited
                     # Look for specific indicators
-                    if 'VFS: Cannot open root device' in line:
-                        print(f"   ❌ Root device error: {line.strip()}")
-                    elif 'VFS: Mounted root' in line:
-                        print(f"   ✅ Root mounted: {line.strip()}")
-                    elif 'Kernel panic' in line:
-                        print(f"   ❌ Kernel panic: {line.strip()}")
-                    elif 'init: /init' in line:
-                        print(f"   ✅ Init started: {line.strip()}")
-                        
-            # Clean up
-            try:
-                proc.terminate()
-                proc.wait(timeout=2)
-            except:
-                proc.kill()
+                    match = DEBUG_PROBE_RE.search(raw)
+                    if match:
+                        line = raw.decode(errors='replace').strip()
+                        results.append(f"   {DEBUG_PROBE_MESSAGES[match.lastgroup]}: {line}")
+                
+                # Clean up
+                if proc.returncode is None:
+                    try:
+                        proc.terminate()
+                        await asyncio.wait_for(proc.wait(), timeout=2)
+                    except (ProcessLookupError, asyncio.TimeoutError):
+                        proc.kill()
+                        await proc.wait()
                 
         except Exception as e:
-            print(f"   ❌ Test failed: {e}")
-            
-        time.sleep(1)  # Brief pause between tests
+            results.append(f"   ❌ Test failed: {e}")
+        
+        return results
+    
+    # Run the probes concurrently so their observation windows overlap
+    for results in await asyncio.gather(*(probe(r, cmd) for r, cmd in zip(debug_recipes, probe_cmds))):
+        print("\n".join(results))
 
     # Test 6: Testing Direct Kernel Boot (Alternative)
     print("\n🔄 Test 6: Testing Direct Kernel Boot (Alternative)")
-    direct_boot_cmd = [
-        os.path.join(terminal_manager.base_dir, 'bin', 'cloud-hypervisor'),
-        '--cpus', 'boot=1',
-        '--memory', 'size=256M',
-        '--kernel', os.path.join(terminal_manager.base_dir, 'bin', 'vmlinux-ch'),
-        '--disk', f'path={os.path.join(terminal_manager.base_dir, "bin", "ubuntu-rootfs.img")}',
+    direct_boot_cmd = boot_args + [
         '--console', 'tty',
         '--serial', 'tty',
         '--cmdline', 'console=ttyS0 root=/dev/vda1 rw'
@@ -738,52 +1095,49 @@ async def test_mode():
     print(f"🔧 Direct boot command: {' '.join(direct_boot_cmd)}")
     
     # Check if all required files exist
-    required_files = {
-        'cloud-hypervisor': os.path.join(terminal_manager.base_dir, 'bin', 'cloud-hypervisor'),
-        'vmlinux-ch': os.path.join(terminal_manager.base_dir, 'bin', 'vmlinux-ch'),
-        'ubuntu-rootfs.img': os.path.join(terminal_manager.base_dir, 'bin', 'ubuntu-rootfs.img')
-    }
+    required_files = ['cloud-hypervisor', 'vmlinux-ch', 'ubuntu-rootfs.img']
     
-    for name, path in required_files.items():
-        if os.path.exists(path):
+    for name in required_files:
+        if name in bin_snapshot:
             print(f"✅ {name}: exists")
         else:
-            print(f"❌ {name}: missing at {path}")
+            print(f"❌ {name}: missing at {os.path.join(bin_dir, name)}")
     
     # Test the direct boot command
     try:
-        proc = subprocess.Popen(direct_boot_cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
-        time.sleep(2)  # Let it start
-        
-        if proc.poll() is None:
+        proc = await asyncio.create_subprocess_exec(
+            *direct_boot_cmd, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE)
+        try:
+            # Console output means the kernel is booting; give an immediate exit a moment to surface
+            if await asyncio.wait_for(proc.stdout.read(65536), timeout=2):
+                await asyncio.wait_for(proc.wait(), timeout=0.1)
+            else:
+                await proc.wait()  # console closed, the VM is exiting
+            stderr = await proc.stderr.read()
+            print(f"❌ Direct boot failed: {stderr.decode(errors='replace')}")
+        except asyncio.TimeoutError:
             print("✅ Direct boot VM started successfully")
             proc.terminate()
-            proc.wait(timeout=2)
-        else:
-            stdout, stderr = proc.communicate()
-            print(f"❌ Direct boot failed: {stderr}")
+            await asyncio.wait_for(proc.wait(), timeout=2)
     except Exception as e:
         print(f"❌ Direct boot exception: {e}")
         
     # Test 7: Network Configuration Check
     print("\n🌐 Test 7: Network Configuration Check")
     try:
-        # Check TAP interface
-        result = subprocess.run(['ip', 'addr', 'show', 'ch-tap0'], capture_output=True, text=True)
-        if result.returncode == 0:
+        # Check TAP interface straight from sysfs rather than spawning ip
+        try:
+            with open('/sys/class/net/ch-tap0/operstate', 'r') as f:
+                state = f.read().strip()
+            with open('/sys/class/net/ch-tap0/address', 'r') as f:
+                mac = f.read().strip()
             print("✅ TAP interface ch-tap0 is configured")
-            # Show just the relevant lines
-            lines = result.stdout.split('\n')
-            for line in lines[:6]:  # First few lines
-                if line.strip():
-                    print(f"   {line}")
-        else:
+            print(f"   state {state}, link/ether {mac}")
+        except FileNotFoundError:
             print("❌ TAP interface ch-tap0 not found")
         
         # Check IP forwarding
-        with open('/proc/sys/net/ipv4/ip_forward', 'r') as f:
-            ip_forward = f.read().strip()
-        if ip_forward == '1':
+        if ip_forward_enabled():
             print("✅ IP forwarding is enabled")
         else:
             print("❌ IP forwarding is disabled")
@@ -794,22 +1148,24 @@ async def test_mode():
     # Test 8: File System Check
     print("\n💾 Test 8: File System Check")
     files_to_check = [
-        ('Cloud Hypervisor binary', os.path.join(terminal_manager.base_dir, 'bin', 'cloud-hypervisor')),
-        ('Hypervisor firmware', os.path.join(terminal_manager.base_dir, 'bin', 'hypervisor-fw')),
-        ('Ubuntu root filesystem image', os.path.join(terminal_manager.base_dir, 'bin', 'ubuntu-rootfs.img')),
-        ('Cloud Hypervisor kernel', os.path.join(terminal_manager.base_dir, 'bin', 'vmlinux-ch'))
+        ('Cloud Hypervisor binary', 'cloud-hypervisor'),
+        ('Hypervisor firmware', 'hypervisor-fw'),
+        ('Ubuntu root filesystem image', 'ubuntu-rootfs.img'),
+        ('Cloud Hypervisor kernel', 'vmlinux-ch')
     ]
     
-    for name, path in files_to_check:
-        if os.path.exists(path):
-            size = os.path.getsize(path)
-            print(f"✅ {name}: {size:,} bytes")
+    all_files_ok = True
+    for name, basename in files_to_check:
+        st = bin_snapshot.get(basename)
+        if st is not None:
+            print(f"✅ {name}: {st.st_size:,} bytes")
         else:
             print(f"❌ {name}: missing")
+            all_files_ok = False
     
     # Clean up test VM
     print("\n🧹 Cleanup: Stopping test VM")
-    close_result = terminal_manager.close_terminal(terminal_id, "test_user")
+    close_result = await terminal_manager.close_terminal_async(terminal_id, "test_user")
     if close_result['success']:
         print("✅ Test VM stopped and cleaned up")
     else:
@@ -854,7 +1210,7 @@ async def main():
     
     # Parse authorized emails
     if args.authorized_emails:
-        authorized_users = set(email.strip() for email in args.authorized_emails.split(',') if email.strip())
+        authorized_users = frozenset(email.strip() for email in args.authorized_emails.split(',') if email.strip())
         print(f"Authorized users: {', '.join(authorized_users)}")
     else:
         print("No email restrictions - all authenticated users allowed")
@@ -868,57 +1224,37 @@ async def main():
         pass
     
     # Service wrapper functions that extract user_id from context and check authorization
-    def check_authorization(context):
-        """Check if user is authorized based on email, raise exception if not"""
-        if not authorized_users:  # If no authorized users specified, allow all
-            return
-        
-        user_email = context.get("user", {}).get("email") if context else None
-        if not user_email:
-            raise AuthorizationError("No user email found in context")
+    @functools.lru_cache(maxsize=4096)
+    def is_authorized(email):
+        """Memoised allow-list decision; the list is fixed once the service starts"""
+        return not authorized_users or email in authorized_users
+    
+    def resolve_user(context, default=None):
+        """Check if user is authorized based on email and return their id, raise exception if not"""
+        if not context:
+            if not is_authorized(None):
+                raise AuthorizationError("No user email found in context")
+            return default
         
-        if user_email not in authorized_users:
+        user = context.get("user") or {}
+        user_email = user.get("email")
+        if not is_authorized(user_email):
+            if not user_email:
+                raise AuthorizationError("No user email found in context")
             raise AuthorizationError(f"Email '{user_email}' not in authorized users list")
+        return user.get("id")
     
-    def create_terminal_with_context(recipe=None, context=None):
-        check_authorization(context)
-        user_id = context.get("user", {}).get("id") if context else "anonymous"
-        return terminal_manager.create_terminal(recipe, user_id)
-    
-    def write_to_terminal_with_context(terminal_id, command, context=None):
-        check_authorization(context)
-        user_id = context.get("user", {}).get("id") if context else None
-        return terminal_manager.write_to_terminal(terminal_id, command, user_id)
-    
-    def read_from_terminal_with_context(terminal_id, context=None):
-        check_authorization(context)
-        user_id = context.get("user", {}).get("id") if context else None
-        return terminal_manager.read_from_terminal(terminal_id, user_id)
-    
-    def close_terminal_with_context(terminal_id, context=None):
-        check_authorization(context)
-        user_id = context.get("user", {}).get("id") if context else None
-        return terminal_manager.close_terminal(terminal_id, user_id)
-    
-    def resize_terminal_with_context(terminal_id, rows, cols, context=None):
-        check_authorization(context)
-        user_id = context.get("user", {}).get("id") if context else None
-        return terminal_manager.resize_terminal(terminal_id, rows, cols, user_id)
-    
-    def list_terminals_with_context(context=None):
-        check_authorization(context)
-        user_id = context.get("user", {}).get("id") if context else None
-        return terminal_manager.list_terminals(user_id)
-    
-    def get_screen_content_with_context(terminal_id, context=None):
-        check_authorization(context)
-        user_id = context.get("user", {}).get("id") if context else None
-        return terminal_manager.get_screen_content(terminal_id, user_id)
-    
-    def get_terminal_status_with_context(terminal_id, context=None):
-        check_authorization(context)
-        user_id = context.get("user", {}).get("id") if context else None
-        return terminal_manager.get_terminal_status(terminal_id, user_id)
+    def with_context(method, default_user=None):
+        """Wrap a terminal_manager method so it authorizes the caller and receives their user_id"""
+        if asyncio.iscoroutinefunction(method):
+            async def wrapper(*args, context=None, **kwargs):
+                return await method(*args, user_id=resolve_user(context, default_user), **kwargs)
+        else:
+            def wrapper(*args, context=None, **kwargs):
+                return method(*args, user_id=resolve_user(context, default_user), **kwargs)
+        wrapper.__name__ = method.__name__
+        wrapper.__doc__ = method.__doc__
+        return wrapper
 
     # Register terminal service
     terminal_service = await server.register_service({
@@ -926,14 +1262,17 @@ async def main():
         "name": "Cloud Hypervisor Terminal Service",
         "type": "rpc",
         "config": {"visibility": "public", "require_context": True, "run_in_executor": True},
-        "create_terminal": create_terminal_with_context,
-        "write_to_terminal": write_to_terminal_with_context,
-        "read_from_terminal": read_from_terminal_with_context,
-        "close_terminal": close_terminal_with_context,
-        "resize_terminal": resize_terminal_with_context,
-        "list_terminals": list_terminals_with_context,
-        "get_screen_content": get_screen_content_with_context,
-        "get_terminal_status": get_terminal_status_with_context,
+        "create_terminal": with_context(terminal_manager.create_terminal_async, "anonymous"),
+        **{name: with_context(getattr(terminal_manager, name)) for name in (
+            "write_to_terminal",
+            "write_many_to_terminal",
+            "read_from_terminal",
+            "close_terminal",
+            "resize_terminal",
+            "list_terminals",
+            "get_screen_content",
+            "get_terminal_status",
+        )},
     })
     
     # Store the terminal service ID for injection into HTML
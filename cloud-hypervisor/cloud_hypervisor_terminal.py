@@ -0,0 +1,11 @@
+"""Importable alias for cloud-hypervisor-terminal.py, whose hyphenated name can't be imported directly"""
+import importlib.util
+import os
+import sys
+
+_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'cloud-hypervisor-terminal.py')
+_spec = importlib.util.spec_from_file_location(__name__, _path)
+_module = importlib.util.module_from_spec(_spec)
+# Replace this shim with the real module so later imports share one instance
+sys.modules[__name__] = _module
+_spec.loader.exec_module(_module)
@@ -11,17 +11,37 @@ This script creates a VM, waits for it to boot, and then tests:
 """
 
 import asyncio
-import time
-import sys
-import os
-import importlib.util
+import re
+import uuid
 
-# Import the terminal class from the hyphen-named module
-sys.path.append(os.path.dirname(os.path.abspath(__file__)))
-spec = importlib.util.spec_from_file_location("cloud_hypervisor_terminal", "cloud-hypervisor-terminal.py")
-module = importlib.util.module_from_spec(spec)
-spec.loader.exec_module(module)
-CloudHypervisorTerminal = module.CloudHypervisorTerminal
+# Import the terminal class through the importable alias of the hyphen-named module
+from cloud_hypervisor_terminal import CloudHypervisorTerminal
+
+# Outcome of a ping command; "100% packet loss" must win over its "0% packet loss" suffix
+PING_RESULT_RE = re.compile(
+    r'(?P<failed>100% packet loss|(?i:network unreachable))|(?P<ok> 0% packet loss|64 bytes from)')
+
+# End-of-output marker echoed after each command; the empty quotes keep the console's echo
+# of the typed line from matching, so only the echo command's own output does
+MARKER_RE = re.compile(r'__DONE_[0-9a-f]+__')
+MARKER_ECHO_RE = re.compile(r'; echo __DONE_""[0-9a-f]+__')
+
+async def run_command(terminal_manager, terminal_id, command, timeout):
+    """Send command and return its output as soon as the end-of-output marker comes back"""
+    token = uuid.uuid4().hex[:8]
+    marker = f"__DONE_{token}__"
+    write_result = terminal_manager.write_to_terminal(
+        terminal_id, f'{command}; echo __DONE_""{token}__\n', "test_user")
+    if not write_result['success']:
+        return write_result
+    
+    wait_result = await terminal_manager.wait_for_pattern_async(terminal_id, [marker], timeout, "test_user")
+    if not wait_result['success']:
+        return wait_result
+    
+    # Drop marker lines, including late ones from an earlier command that timed out
+    output = "\n".join(line for line in wait_result['output'].split('\n') if not MARKER_RE.search(line))
+    return {"output": MARKER_ECHO_RE.sub('', output), "success": True}
 
 async def test_vm_complete():
     """Complete VM functionality test"""
@@ -42,7 +62,7 @@ async def test_vm_complete():
     }
     
     print("🚀 Step 1: Creating VM...")
-    result = terminal_manager.create_terminal(test_recipe, "test_user")
+    result = await terminal_manager.create_terminal_async(test_recipe, "test_user")
     if not result['success']:
         print(f"❌ VM creation failed: {result['error']}")
         return False
@@ -53,33 +73,27 @@ async def test_vm_complete():
     # Wait for VM to boot and show boot process
     print("\n📺 Step 2: Monitoring VM Boot...")
     boot_timeout = 60  # Longer timeout for complete boot
-    start_time = time.time()
     boot_complete = False
     
-    while time.time() - start_time < boot_timeout:
-        read_result = terminal_manager.read_from_terminal(terminal_id, "test_user")
-        if read_result['success'] and read_result['output']:
-            output = read_result['output']
-            print(f"   {output.strip()}")
-            
-            # Check for successful boot indicators
-            if any(indicator in output.lower() for indicator in 
-                   ["login:", "# ", "$ ", "root@", "welcome"]):
-                print("✅ VM boot successful - shell prompt detected!")
-                boot_complete = True
-                break
-            elif "panic" in output.lower() or "kernel panic" in output.lower():
-                print(f"❌ VM boot failed with panic")
-                break
-        
-        time.sleep(2)
+    # Returns as soon as a boot indicator or a panic shows up on the console
+    wait_result = await terminal_manager.wait_for_pattern_async(
+        terminal_id, ["login:", "# ", "$ ", "root@", "welcome", "panic"], boot_timeout, "test_user")
+    if wait_result['success']:
+        if wait_result['output']:
+            print(f"   {wait_result['output'].strip()}")
+        matched = wait_result['matched']
+        if matched and matched.lower() == "panic":
+            print(f"❌ VM boot failed with panic")
+        elif matched:
+            print("✅ VM boot successful - shell prompt detected!")
+            boot_complete = True
     
     if not boot_complete:
         print("⚠️  VM boot monitoring timed out, but continuing with tests...")
     
-    # Give the VM a moment to fully initialize
+    # Give the VM a moment to fully initialize; a prompt on the console means it is nearly there
     print("\n⏳ Step 3: Waiting for VM to fully initialize...")
-    time.sleep(5)
+    await asyncio.sleep(1 if boot_complete else 5)
     
     # Test basic shell functionality
     print("\n🔧 Step 4: Testing Basic Shell Commands...")
@@ -97,20 +111,12 @@ async def test_vm_complete():
     for command, description in commands_to_test:
         print(f"   Testing: {description}")
         
-        # Send command
-        write_result = terminal_manager.write_to_terminal(terminal_id, command + "\n", "test_user")
-        if not write_result['success']:
-            print(f"   ❌ Failed to send command: {write_result['error']}")
+        # Send command and read its response
+        command_result = await run_command(terminal_manager, terminal_id, command, 10)
+        if not command_result['success']:
+            print(f"   ❌ Failed to send command: {command_result['error']}")
             continue
-        
-        # Read response
-        time.sleep(2)
-        response = ""
-        for _ in range(5):  # Try reading multiple times
-            read_result = terminal_manager.read_from_terminal(terminal_id, "test_user")
-            if read_result['success'] and read_result['output']:
-                response += read_result['output']
-            time.sleep(0.5)
+        response = command_result['output']
         
         if response.strip():
             print(f"   ✅ {description}: Got response")
@@ -134,24 +140,18 @@ async def test_vm_complete():
     for command, description in network_commands:
         print(f"   Testing: {description}")
         
-        write_result = terminal_manager.write_to_terminal(terminal_id, command + "\n", "test_user")
-        if not write_result['success']:
-            print(f"   ❌ Failed to send command: {write_result['error']}")
-            continue
-        
         # Network commands take longer
-        time.sleep(5)
-        response = ""
-        for _ in range(10):
-            read_result = terminal_manager.read_from_terminal(terminal_id, "test_user")
-            if read_result['success'] and read_result['output']:
-                response += read_result['output']
-            time.sleep(0.5)
+        command_result = await run_command(terminal_manager, terminal_id, command, 20)
+        if not command_result['success']:
+            print(f"   ❌ Failed to send command: {command_result['error']}")
+            continue
+        response = command_result['output']
         
         if "ping" in command.lower():
-            if "0% packet loss" in response or "64 bytes from" in response:
+            result = PING_RESULT_RE.search(response)
+            if result and result.lastgroup == 'ok':
                 print(f"   ✅ {description}: Success")
-            elif "100% packet loss" in response or "network unreachable" in response.lower():
+            elif result:
                 print(f"   ❌ {description}: Failed")
             else:
                 print(f"   ⚠️  {description}: Unclear result")
@@ -174,25 +174,19 @@ async def test_vm_complete():
     for command, description in python_commands:
         print(f"   Testing: {description}")
         
-        write_result = terminal_manager.write_to_terminal(terminal_id, command + "\n", "test_user")
-        if not write_result['success']:
-            print(f"   ❌ Failed to send command: {write_result['error']}")
+        command_result = await run_command(terminal_manager, terminal_id, command, 10)
+        if not command_result['success']:
+            print(f"   ❌ Failed to send command: {command_result['error']}")
             continue
-        
-        time.sleep(3)
-        response = ""
-        for _ in range(5):
-            read_result = terminal_manager.read_from_terminal(terminal_id, "test_user")
-            if read_result['success'] and read_result['output']:
-                response += read_result['output']
-            time.sleep(0.5)
+        response = command_result['output']
         
         if response.strip():
             print(f"   ✅ {description}: Success")
             # Show the actual output for Python commands
-            for line in response.split('\n'):
-                if line.strip() and not line.startswith('#') and 'python3' not in line.lower():
-                    print(f"      → {line.strip()}")
+            lines = [f"      → {line.strip()}" for line in response.split('\n')
+                     if line.strip() and not line.startswith('#') and 'python3' not in line.lower()]
+            if lines:
+                print("\n".join(lines))
         else:
             print(f"   ⚠️  {description}: No response")
     
@@ -203,11 +197,11 @@ async def test_vm_complete():
         status = status_result['status']
         print(f"   ✅ VM Status: {'Running' if status['running'] else 'Stopped'}")
         print(f"   📍 PID: {status['pid']}")
-        print(f"   ⏰ Uptime: {int(time.time() - status['created'])} seconds")
+        print(f"   ⏰ Uptime: {int(status['uptime'])} seconds")
     
     # Cleanup
     print("\n🧹 Step 8: Cleanup...")
-    close_result = terminal_manager.close_terminal(terminal_id, "test_user")
+    close_result = await terminal_manager.close_terminal_async(terminal_id, "test_user")
     if close_result['success']:
         print("   ✅ VM stopped and cleaned up successfully")
     else:
@@ -5,17 +5,14 @@ Simple Cloud Hypervisor VM Test - Just verify boot and basic functionality
 """
 
 import asyncio
-import time
+import re
 import sys
-import os
-import importlib.util
 
-# Import the terminal class from the hyphen-named module
-sys.path.append(os.path.dirname(os.path.abspath(__file__)))
-spec = importlib.util.spec_from_file_location("cloud_hypervisor_terminal", "cloud-hypervisor-terminal.py")
-module = importlib.util.module_from_spec(spec)
-spec.loader.exec_module(module)
-CloudHypervisorTerminal = module.CloudHypervisorTerminal
+# Import the terminal class through the importable alias of the hyphen-named module
+from cloud_hypervisor_terminal import CloudHypervisorTerminal
+
+# Non-blank console line with surrounding whitespace and the serial console's \r trimmed
+BOOT_LINE_RE = re.compile(r'^[ \t]*(\S[^\r\n]*?)[ \t\r]*$', re.MULTILINE)
 
 async def test_vm_simple():
     """Simple VM test - just verify boot and basic functionality"""
@@ -36,7 +33,7 @@ async def test_vm_simple():
     }
     
     print("🚀 Creating VM with direct kernel boot...")
-    result = terminal_manager.create_terminal(test_recipe, "test_user")
+    result = await terminal_manager.create_terminal_async(test_recipe, "test_user")
     if not result['success']:
         print(f"❌ VM creation failed: {result['error']}")
         return False
@@ -45,26 +42,20 @@ async def test_vm_simple():
     print(f"✅ VM created successfully: {terminal_id}")
     
     print("\n📺 Monitoring VM boot (showing first 30 seconds)...")
-    start_time = time.time()
     boot_complete = False
     
-    while time.time() - start_time < 30:
-        read_result = terminal_manager.read_from_terminal(terminal_id, "test_user")
-        if read_result['success'] and read_result['output']:
-            output = read_result['output']
-            
-            # Show boot messages
-            for line in output.split('\n'):
-                if line.strip():
-                    print(f"   {line.strip()}")
-            
-            # Look for actual shell prompt (not just kernel messages)
-            if "# " in output or "$ " in output or "root@" in output:
-                print("✅ Shell prompt detected!")
-                boot_complete = True
-                break
+    # Look for actual shell prompt (not just kernel messages)
+    wait_result = await terminal_manager.wait_for_pattern_async(
+        terminal_id, ["# ", "$ ", "root@"], 30, "test_user")
+    if wait_result['success']:
+        # Show boot messages in one write rather than one per line
+        lines = BOOT_LINE_RE.findall(wait_result['output'])
+        if lines:
+            sys.stdout.write("   " + "\n   ".join(lines) + "\n")
         
-        time.sleep(1)
+        if wait_result['matched']:
+            print("✅ Shell prompt detected!")
+            boot_complete = True
     
     if boot_complete:
         print("\n🎉 VM Boot Successful!")
@@ -75,7 +66,7 @@ async def test_vm_simple():
         print("\n🧪 Testing basic command...")
         write_result = terminal_manager.write_to_terminal(terminal_id, "echo 'Hello VM'\n", "test_user")
         if write_result['success']:
-            time.sleep(2)
+            await asyncio.sleep(2)
             read_result = terminal_manager.read_from_terminal(terminal_id, "test_user")
             if read_result['success'] and read_result['output']:
                 print(f"✅ Command response: {read_result['output'].strip()}")
@@ -92,11 +83,11 @@ async def test_vm_simple():
         status = status_result['status']
         print(f"   Status: {'✅ Running' if status['running'] else '❌ Stopped'}")
         print(f"   PID: {status['pid']}")
-        print(f"   Uptime: {int(time.time() - status['created'])} seconds")
+        print(f"   Uptime: {int(status['uptime'])} seconds")
     
     # Cleanup
     print("\n🧹 Cleaning up...")
-    close_result = terminal_manager.close_terminal(terminal_id, "test_user")
+    close_result = await terminal_manager.close_terminal_async(terminal_id, "test_user")
     if close_result['success']:
         print("✅ VM stopped and cleaned up")
     
@@ -3,29 +3,119 @@ import ptyprocess
 import subprocess
 import os
 import signal
-import select
+import selectors
 import sys
 import argparse
 import uuid
 import time
+import socket
+import http.client
 from hypha_rpc import connect_to_server, login
 from fastapi import FastAPI
 from fastapi.responses import HTMLResponse, FileResponse
 from fastapi.staticfiles import StaticFiles
 import json
 import threading
+import collections
+import codecs
+import itertools
+
+# Firecracker API request bodies; they never change, so they are kept as ready-to-send bytes
+FIRECRACKER_CONFIG_REQUESTS = (
+    ('/boot-source',
+     b'{"kernel_image_path":"bin/vmlinux","boot_args":"console=ttyS0 reboot=k panic=1 pci=off root=/dev/vda rw init=/init ip=172.16.0.2::172.16.0.1:255.255.255.0::eth0:off:130.237.72.200:130.237.72.201"}',
+     "Failed to configure boot source"),
+    ('/machine-config',
+     b'{"vcpu_count":2,"mem_size_mib":256}',
+     "Failed to configure machine"),
+    ('/network-interfaces/eth0',
+     b'{"iface_id":"eth0","host_dev_name":"ftap0"}',
+     "Failed to configure network interface"),
+    ('/drives/rootfs',
+     b'{"drive_id":"rootfs","path_on_host":"bin/rootfs.img","is_root_device":true,"is_read_only":false}',
+     "Failed to configure drive"),
+)
+INSTANCE_START_BODY = b'{"action_type":"InstanceStart"}'
+API_HEADERS = {'Accept': 'application/json', 'Content-Type': 'application/json'}
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    """HTTP connection to a server listening on a Unix domain socket, such as the Firecracker API"""
+    def __init__(self, socket_path, timeout=10):
+        super().__init__('localhost', timeout=timeout)
+        self.socket_path = socket_path
+    
+    def connect(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.settimeout(self.timeout)
+            sock.connect(self.socket_path)
+        except OSError:
+            sock.close()
+            raise
+        self.sock = sock
 
 class FirecrackerTerminal:
     def __init__(self):
         self.user_terminals = {}  # user_id -> {terminal_id -> terminal_data}
-        self.terminal_counter = 0
+        self._by_id = {}  # terminal_id -> terminal_data, same records indexed for O(1) lookup
+        self.terminal_counter = itertools.count()  # next() is atomic, so concurrent creates get distinct IDs
+        # Single selector watching every VM console; serviced by a background thread
+        self._selector = selectors.DefaultSelector()
+        self._reader_thread = threading.Thread(target=self._reader_loop, daemon=True)
+        self._reader_thread.start()
+    
+    def _reader_loop(self):
+        """Drain VM console output as soon as the kernel reports it ready"""
+        while True:
+            for key, _ in self._selector.select():
+                self._on_console_ready(key.fd, key.data)
+    
+    def _on_console_ready(self, fd, terminal):
+        """Move available console output into the terminal buffers"""
+        # The pipe is non-blocking, so empty it completely on each readiness event
+        chunks = []
+        closed = False
+        while True:
+            try:
+                chunk = os.read(fd, 65536)
+            except BlockingIOError:
+                break
+            except OSError:
+                chunk = b''
+            if not chunk:
+                closed = True
+                break
+            chunks.append(chunk)
+        
+        if closed:
+            # EOF - the VM closed its console
+            self._unwatch_console(terminal)
+        if not chunks and not closed:
+            return
+        
+        output_ready = terminal['output_ready']
+        with output_ready:
+            if chunks:
+                output = b''.join(chunks)
+                terminal['pending_output'].append(output)
+                # Store raw output in screen buffer for reconnection (oldest chunks drop off)
+                terminal['screen_buffer'].append(output)
+            if closed:
+                terminal['console_closed'] = True
+            output_ready.notify_all()
+    
+    def _unwatch_console(self, terminal):
+        """Stop watching a terminal's console output"""
+        try:
+            self._selector.unregister(terminal['process'].stdout)
+        except (KeyError, ValueError):
+            pass
     
     def create_terminal(self, recipe, user_id):
         """Create a new terminal session with firecracker VM"""
         print(f"Creating terminal for user: {user_id}, recipe: {recipe}")
         # Generate unique terminal ID and session UUID
-        terminal_id = f"terminal_{self.terminal_counter}"
-        self.terminal_counter += 1
+        terminal_id = f"terminal_{next(self.terminal_counter)}"
         session_uuid = str(uuid.uuid4())
         
         # Create unique socket path for this terminal session
@@ -37,10 +127,13 @@ class FirecrackerTerminal:
             '--api-sock', socket_path
         ]
         
+        firecracker_process = None
         try:
             # Remove existing socket if it exists
-            if os.path.exists(socket_path):
+            try:
                 os.unlink(socket_path)
+            except FileNotFoundError:
+                pass
             
             # Start firecracker process without capturing stdout/stderr initially
             # We'll let firecracker output go to its own streams first
@@ -49,127 +142,125 @@ class FirecrackerTerminal:
                 stdout=subprocess.PIPE,
                 stderr=subprocess.STDOUT,  # Merge stderr into stdout
                 stdin=subprocess.PIPE,
-                preexec_fn=os.setsid,
+                start_new_session=True,  # own process group for killpg, without preexec_fn's slow fork path
                 bufsize=0  # Unbuffered
             )
             
-            # Wait a bit for firecracker to start and create the socket
-            time.sleep(2)
-            
             # Configure firecracker VM using the socket
             print(f"Configuring firecracker VM with socket: {socket_path}")
             self._configure_firecracker(socket_path)
             print(f"Firecracker VM configured and started for terminal: {terminal_id}")
             
-            # Initialize user terminals if not exists
-            if user_id not in self.user_terminals:
-                self.user_terminals[user_id] = {}
-            
-            self.user_terminals[user_id][terminal_id] = {
+            terminal = {
                 'process': firecracker_process,
                 'socket_path': socket_path,
                 'session_uuid': session_uuid,
                 'created_at': time.time(),
                 'user_id': user_id,
-                'screen_buffer': []
+                'screen_buffer': collections.deque(maxlen=1000),  # last 1000 raw output chunks
+                'pending_output': [],  # raw console output not yet returned by read_from_terminal
+                'output_ready': threading.Condition(),  # guards the buffers, notified on new output
+                'console_closed': False,  # set by the reader thread once the console hits EOF
+                'decoder': codecs.getincrementaldecoder('utf-8')(errors='replace'),  # holds back split UTF-8 sequences between reads
+                'write_queue': collections.deque(),  # console input waiting for the thread that is writing
+                'write_lock': threading.Lock(),  # guards write_queue and writing
+                'writing': False  # whether some thread is currently draining write_queue
             }
+            # setdefault so concurrent creates for one user don't replace each other's dict
+            self.user_terminals.setdefault(user_id, {})[terminal_id] = terminal
+            self._by_id[terminal_id] = terminal
+            os.set_blocking(firecracker_process.stdout.fileno(), False)
+            self._selector.register(firecracker_process.stdout, selectors.EVENT_READ, terminal)
             
             return {"terminal_id": terminal_id, "success": True}
             
         except Exception as e:
+            # Don't leave a half-configured VMM and its API socket behind
+            if firecracker_process is not None:
+                try:
+                    os.killpg(firecracker_process.pid, signal.SIGKILL)
+                except OSError:
+                    pass
+                firecracker_process.wait()
+                firecracker_process.stdin.close()
+                firecracker_process.stdout.close()
+            try:
+                os.unlink(socket_path)
+            except OSError:
+                pass
             return {"error": str(e), "success": False}
     
+    async def create_terminal_async(self, recipe, user_id):
+        """Create a terminal on a worker thread so the event loop stays responsive while the VM starts"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, self.create_terminal, recipe, user_id)
+    
     def _configure_firecracker(self, socket_path):
         """Configure firecracker VM using the commands from boot.sh"""
         
-        # Wait for socket to be available
-        max_attempts = 10
-        for attempt in range(max_attempts):
-            if os.path.exists(socket_path):
-                break
-            time.sleep(0.5)
-        else:
-            raise Exception(f"Firecracker socket {socket_path} not available after {max_attempts} attempts")
-        
-        # Configure boot source
-        boot_cmd = [
-            'curl', '--unix-socket', socket_path, '-i',
-            '-X', 'PUT', 'http://localhost/boot-source',
-            '-H', 'Accept: application/json',
-            '-H', 'Content-Type: application/json',
-            '-d', '{"kernel_image_path":"bin/vmlinux","boot_args":"console=ttyS0 reboot=k panic=1 pci=off root=/dev/vda rw init=/init ip=172.16.0.2::172.16.0.1:255.255.255.0::eth0:off:130.237.72.200:130.237.72.201"}'
-        ]
-        
-        result = subprocess.run(boot_cmd, capture_output=True, text=True)
-        if result.returncode != 0:
-            raise Exception(f"Failed to configure boot source: {result.stderr}")
-        
-        # Configure memory and vCPUs
-        machine_cmd = [
-            'curl', '--unix-socket', socket_path, '-i',
-            '-X', 'PUT', 'http://localhost/machine-config',
-            '-H', 'Accept: application/json',
-            '-H', 'Content-Type: application/json',
-            '-d', '{"vcpu_count":2,"mem_size_mib":256}'
-        ]
-        
-        result = subprocess.run(machine_cmd, capture_output=True, text=True)
-        if result.returncode != 0:
-            raise Exception(f"Failed to configure machine: {result.stderr}")
-        
-        # Configure network interface
-        network_cmd = [
-            'curl', '--unix-socket', socket_path, '-i',
-            '-X', 'PUT', 'http://localhost/network-interfaces/eth0',
-            '-H', 'Accept: application/json',
-            '-H', 'Content-Type: application/json',
-            '-d', '{"iface_id":"eth0","host_dev_name":"ftap0"}'
-        ]
-        
-        result = subprocess.run(network_cmd, capture_output=True, text=True)
-        if result.returncode != 0:
-            raise Exception(f"Failed to configure network interface: {result.stderr}")
-        
-        # Configure root filesystem
-        drive_cmd = [
-            'curl', '--unix-socket', socket_path, '-i',
-            '-X', 'PUT', 'http://localhost/drives/rootfs',
-            '-H', 'Accept: application/json',
-            '-H', 'Content-Type: application/json',
-            '-d', '{"drive_id":"rootfs","path_on_host":"bin/rootfs.img","is_root_device":true,"is_read_only":false}'
-        ]
-        
-        result = subprocess.run(drive_cmd, capture_output=True, text=True)
-        if result.returncode != 0:
-            raise Exception(f"Failed to configure drive: {result.stderr}")
-        
-        # Start the instance
-        start_cmd = [
-            'curl', '--unix-socket', socket_path, '-i',
-            '-X', 'PUT', 'http://localhost/actions',
-            '-H', 'Accept: application/json',
-            '-H', 'Content-Type: application/json',
-            '-d', '{"action_type":"InstanceStart"}'
-        ]
-        
-        result = subprocess.run(start_cmd, capture_output=True, text=True)
-        if result.returncode != 0:
-            raise Exception(f"Failed to start instance: {result.stderr}")
-        
-        # Wait a bit for the VM to start booting
-        time.sleep(3)
+        # Issue every API call over one keep-alive connection instead of a curl process each
+        api = UnixHTTPConnection(socket_path)
+        try:
+            # Retry connecting until firecracker is listening, which the socket file existing doesn't guarantee
+            timeout = 5
+            deadline = time.monotonic() + timeout
+            delay = 0.005
+            while True:
+                try:
+                    api.connect()
+                    break
+                except OSError:
+                    if time.monotonic() >= deadline:
+                        raise Exception(f"Firecracker socket {socket_path} not available after {timeout} seconds")
+                    time.sleep(delay)
+                    delay = min(delay * 2, 0.1)
+            
+            # Boot source, machine, network and drive settings are independent of each other
+            for path, body, error_message in FIRECRACKER_CONFIG_REQUESTS:
+                self._api_put(api, path, body, error_message)
+            
+            # Start the instance once everything is configured
+            self._api_put(api, '/actions', INSTANCE_START_BODY, "Failed to start instance")
+            
+            # Wait for the VM to report itself running rather than sleeping a fixed time
+            self._wait_until_running(api)
+        finally:
+            api.close()
+    
+    def _wait_until_running(self, api, timeout=3):
+        """Poll the Firecracker instance state with backoff until it is Running or timeout expires"""
+        deadline = time.monotonic() + timeout
+        delay = 0.005
+        while True:
+            try:
+                api.request('GET', '/', headers={'Accept': 'application/json'})
+                info = json.loads(api.getresponse().read() or b'{}')
+                if info.get('state') == 'Running':
+                    return
+            except (OSError, http.client.HTTPException, ValueError):
+                api.close()  # reconnect on the next request
+            if time.monotonic() >= deadline:
+                return
+            time.sleep(delay)
+            delay = min(delay * 2, 0.1)
+    
+    def _api_put(self, api, path, body, error_message):
+        """PUT a JSON body to the Firecracker API, raising with the API's reply on failure"""
+        try:
+            api.request('PUT', path, body=body, headers=API_HEADERS)
+            response = api.getresponse()
+            reply = response.read()
+        except (OSError, http.client.HTTPException) as e:
+            raise Exception(f"{error_message}: {e}")
+        if response.status >= 300:
+            raise Exception(f"{error_message}: HTTP {response.status} {reply.decode('utf-8', errors='replace')}")
     
     def _find_terminal(self, terminal_id, user_id=None):
         """Find terminal by ID, optionally restricted to a specific user"""
-        if user_id:
-            if user_id in self.user_terminals and terminal_id in self.user_terminals[user_id]:
-                return self.user_terminals[user_id][terminal_id]
-        else:
-            # Search across all users
-            for user_terminals in self.user_terminals.values():
-                if terminal_id in user_terminals:
-                    return user_terminals[terminal_id]
-        return None
+        terminal = self._by_id.get(terminal_id)
+        if terminal is None or (user_id and terminal['user_id'] != user_id):
+            return None
+        return terminal
     
     def write_to_terminal(self, terminal_id, command, user_id=None):
         terminal = self._find_terminal(terminal_id, user_id)
@@ -178,46 +269,69 @@ class FirecrackerTerminal:
         
         try:
             # Write to the firecracker process stdin (which becomes VM serial console input)
-            if terminal['process'].stdin and not terminal['process'].stdin.closed:
-                terminal['process'].stdin.write(command.encode())
-                terminal['process'].stdin.flush()
-                return {"success": True}
-            else:
-                return {"error": "Process stdin not available", "success": False}
+            fd = terminal['process'].stdin.fileno()
+            data = command if isinstance(command, (bytes, bytearray)) else command.encode()
+            with terminal['write_lock']:
+                terminal['write_queue'].append(data)
+                if terminal['writing']:
+                    # The thread already writing picks this up in its next batch
+                    return {"success": True}
+                terminal['writing'] = True
+            self._drain_writes(terminal, fd)
+            return {"success": True}
+        except ValueError:
+            # Writing to a closed stdin
+            return {"error": "Process stdin not available", "success": False}
         except Exception as e:
             return {"error": str(e), "success": False}
     
+    def _drain_writes(self, terminal, fd):
+        """Write queued console input until the queue is empty, one writev per batch"""
+        write_queue = terminal['write_queue']
+        try:
+            while True:
+                with terminal['write_lock']:
+                    if not write_queue:
+                        terminal['writing'] = False
+                        return
+                    chunks = [write_queue.popleft() for _ in range(min(len(write_queue), 1024))]
+                
+                written = os.writev(fd, chunks)
+                remaining = b''.join(chunks)[written:] if written < sum(map(len, chunks)) else b''
+                while remaining:
+                    remaining = remaining[os.write(fd, remaining):]
+        except BaseException:
+            # Drop what is left so later writes aren't stuck behind a broken pipe
+            with terminal['write_lock']:
+                write_queue.clear()
+                terminal['writing'] = False
+            raise
+    
     def read_from_terminal(self, terminal_id, user_id=None):
         terminal = self._find_terminal(terminal_id, user_id)
         if not terminal:
             return {"error": "Terminal not found", "success": False}
         
         try:
-            # Check if process is alive
-            if terminal['process'].poll() is not None:
-                return {"error": "Process not alive", "success": False}
+            # Hand over whatever the reader thread collected, waiting briefly if nothing yet;
+            # the reader's EOF flag stands in for polling the process on every call
+            output_ready = terminal['output_ready']
+            pending_output = terminal['pending_output']
+            with output_ready:
+                if not pending_output and not terminal['console_closed']:
+                    output_ready.wait(0.1)
+                raw_output = b''.join(pending_output)
+                pending_output.clear()
+                console_closed = terminal['console_closed']
+                # The web client appends output as text, so decode once here, carrying partial characters
+                # over; under the lock so concurrent reads can't interleave the decoder's state
+                output = terminal['decoder'].decode(raw_output)
             
-            # Use select for non-blocking read from stdout (VM serial console output)
-            process = terminal['process']
-            if process.stdout and not process.stdout.closed:
-                ready, _, _ = select.select([process.stdout], [], [], 0.1)  # 0.1 second timeout
-                
-                if ready:
-                    try:
-                        output = os.read(process.stdout.fileno(), 4096)  # Larger buffer for VM output
-                        if output:
-                            decoded_output = output.decode('utf-8', errors='replace')  # Use 'replace' for invalid chars
-                            # Store output in screen buffer for reconnection
-                            terminal['screen_buffer'].append(decoded_output)
-                            # Keep buffer size reasonable (last 1000 entries)
-                            if len(terminal['screen_buffer']) > 1000:
-                                terminal['screen_buffer'] = terminal['screen_buffer'][-1000:]
-                            return {"output": decoded_output, "success": True}
-                    except OSError:
-                        # No data available or connection closed
-                        pass
+            # Output written before the VM exited is still handed over first
+            if console_closed and not raw_output:
+                return {"error": "Process not alive", "success": False}
             
-            return {"output": "", "success": True}
+            return {"output": output, "success": True}
         except Exception as e:
             return {"error": str(e), "success": False}
     
@@ -226,26 +340,32 @@ class FirecrackerTerminal:
         if not terminal:
             return {"error": "Terminal not found", "success": False}
         
+        self._unwatch_console(terminal)
+        
+        # Ask firecracker to exit, killing its whole process group if it doesn't within a second
+        process = terminal['process']
         try:
-            # Kill the firecracker process
-            os.killpg(os.getpgid(terminal['process'].pid), signal.SIGTERM)
-            
-            # Clean up socket file
-            if os.path.exists(terminal['socket_path']):
-                os.unlink(terminal['socket_path'])
+            process.terminate()
+            process.wait(timeout=1.0)
+        except subprocess.TimeoutExpired:
+            try:
+                # start_new_session made the process its own group leader, so its pid is the group id
+                os.killpg(process.pid, signal.SIGKILL)
+                process.wait()
+            except OSError:
+                pass
         except:
             pass
         
-        # Remove from user's terminals
-        if user_id and user_id in self.user_terminals:
-            if terminal_id in self.user_terminals[user_id]:
-                del self.user_terminals[user_id][terminal_id]
-        else:
-            # Find and remove from any user
-            for user_terminals in self.user_terminals.values():
-                if terminal_id in user_terminals:
-                    del user_terminals[terminal_id]
-                    break
+        # Clean up socket file, even if the process was already gone
+        try:
+            os.unlink(terminal['socket_path'])
+        except OSError:
+            pass
+        
+        # Remove from user's terminals and the ID index
+        self._by_id.pop(terminal_id, None)
+        self.user_terminals[terminal['user_id']].pop(terminal_id, None)
         
         return {"success": True}
     
@@ -270,10 +390,7 @@ class FirecrackerTerminal:
                 return {"terminals": [], "success": True}
         else:
             # Return all terminals across all users (admin function)
-            all_terminals = []
-            for user_terminals in self.user_terminals.values():
-                all_terminals.extend(user_terminals.keys())
-            return {"terminals": all_terminals, "success": True}
+            return {"terminals": list(self._by_id), "success": True}
     
     def get_screen_content(self, terminal_id, user_id=None):
         terminal = self._find_terminal(terminal_id, user_id)
@@ -282,8 +399,9 @@ class FirecrackerTerminal:
         
         try:
             # Return the accumulated screen buffer
-            screen_content = ''.join(terminal['screen_buffer'])
-            return {"content": screen_content, "success": True}
+            with terminal['output_ready']:
+                screen_content = b''.join(terminal['screen_buffer'])
+            return {"content": screen_content.decode('utf-8', errors='replace'), "success": True}
         except Exception as e:
             return {"error": str(e), "success": False}
 
@@ -297,22 +415,31 @@ app = FastAPI()
 terminal_service_id = None
 
 # Global variable to store authorized users
-authorized_users = set()
+authorized_users = frozenset()
 
-@app.get("/", response_class=HTMLResponse)
-async def serve_index():
+# Global variable to store the index page with the service ID injected, built once
+index_html = None
+
+def render_index():
+    """Read firecracker-index.html and inject the terminal service ID, or None if it is missing"""
     try:
-        with open("./firecracker-index.html", "r") as f:
+        with open("./firecracker-index.html", "rb") as f:
             html_content = f.read()
-            # Inject the terminal service ID into the HTML
-            if terminal_service_id:
-                html_content = html_content.replace(
-                    "{{TERMINAL_SERVICE_ID}}", 
-                    terminal_service_id
-                )
-            return html_content
     except FileNotFoundError:
-        return """
+        return None
+    # Inject the terminal service ID into the HTML
+    if terminal_service_id:
+        html_content = html_content.replace(b"{{TERMINAL_SERVICE_ID}}", terminal_service_id.encode())
+    return html_content
+
+@app.get("/", response_class=HTMLResponse)
+async def serve_index():
+    global index_html
+    if index_html is None:
+        index_html = render_index()
+    if index_html is not None:
+        return HTMLResponse(content=index_html)
+    return """
         <html>
         <head><title>Firecracker Terminal Client Not Found</title></head>
         <body>
@@ -323,13 +450,32 @@ async def serve_index():
         """
 
 async def serve_static(args, context=None):
+    global index_html
     scope = args["scope"]
     if context:
         print(f'{context["user"]["id"]} - {scope["client"]} - {scope["method"]} - {scope["path"]}')
+    
+    # Answer GET / straight from the cached page without going through FastAPI's routing
+    if scope["method"] == "GET" and scope["path"] in ("/", ""):
+        if index_html is None:
+            index_html = render_index()
+        if index_html is not None:
+            send = args["send"]
+            await send({
+                "type": "http.response.start",
+                "status": 200,
+                "headers": [
+                    (b"content-type", b"text/html; charset=utf-8"),
+                    (b"content-length", str(len(index_html)).encode()),
+                ],
+            })
+            await send({"type": "http.response.body", "body": index_html})
+            return
+    
     await app(args["scope"], args["receive"], args["send"])
 
 async def main():
-    global terminal_service_id, authorized_users
+    global terminal_service_id, authorized_users, index_html
     
     # Parse command line arguments
     parser = argparse.ArgumentParser(description='Firecracker Terminal Service')
@@ -339,10 +485,12 @@ async def main():
     
     # Parse authorized emails
     if args.authorized_emails:
-        authorized_users = set(email.strip() for email in args.authorized_emails.split(',') if email.strip())
+        authorized_users = frozenset(email.strip() for email in args.authorized_emails.split(',') if email.strip())
         print(f"Authorized users: {', '.join(authorized_users)}")
     else:
         print("No email restrictions - all authenticated users allowed")
+    # The list is fixed for the life of the service, so decide once whether calls need checking
+    authorization_enabled = bool(authorized_users)
     
     token = await login({"server_url": "https://hypha.aicell.io"})
     # Connect to Hypha server
@@ -355,20 +503,19 @@ async def main():
     # Service wrapper functions that extract user_id from context and check authorization
     def check_authorization(context):
         """Check if user is authorized based on email, raise exception if not"""
-        if not authorized_users:  # If no authorized users specified, allow all
+        if not authorization_enabled:  # If no authorized users specified, allow all
             return
         
-        user_email = context.get("user", {}).get("email") if context else None
-        if not user_email:
-            raise AuthorizationError("No user email found in context")
-        
+        user_email = (context or {}).get("user", {}).get("email")
         if user_email not in authorized_users:
+            if not user_email:
+                raise AuthorizationError("No user email found in context")
             raise AuthorizationError(f"Email '{user_email}' not in authorized users list")
     
-    def create_terminal_with_context(recipe, context=None):
+    async def create_terminal_with_context(recipe, context=None):
         check_authorization(context)
         user_id = context.get("user", {}).get("id") if context else "anonymous"
-        return terminal_manager.create_terminal(recipe, user_id)
+        return await terminal_manager.create_terminal_async(recipe, user_id)
     
     def write_to_terminal_with_context(terminal_id, command, context=None):
         check_authorization(context)
@@ -415,8 +562,9 @@ async def main():
         "get_screen_content": get_screen_content_with_context,
     })
     
-    # Store the terminal service ID for injection into HTML
+    # Store the terminal service ID and bake it into the index page
     terminal_service_id = terminal_service.id
+    index_html = render_index()
     
     # Register static file service
     static_service = await server.register_service({
@@ -434,4 +582,10 @@ async def main():
     await server.serve()
 
 if __name__ == "__main__":
+    # Run the service loop on uvloop when it is installed; the stdlib loop works the same, just slower
+    try:
+        import uvloop
+        uvloop.install()
+    except ImportError:
+        pass
     asyncio.run(main())
\ No newline at end of file
@@ -1,8 +1,9 @@
 import asyncio
-import ptyprocess
 import os
 import signal
 import select
+import errno
+import selectors
 import sys
 import argparse
 from hypha_rpc import connect_to_server, login
@@ -12,118 +13,539 @@ from fastapi.staticfiles import StaticFiles
 import json
 import threading
 import time
+import codecs
+import collections
+import queue
+import functools
+import pty
+import fcntl
+import termios
+import struct
+import gzip
+import hashlib
+
+class ShellPty:
+    """A shell on a pseudo-terminal, driven directly through the master fd"""
+    __slots__ = ('pid', 'fd', 'exitstatus', '_reap_lock')
+    
+    def __init__(self, pid, fd):
+        self.pid = pid
+        self.fd = fd
+        self.exitstatus = None  # wait status once the shell has been reaped
+        # The reader thread and the close thread both reap; only one may waitpid, and once the pid
+        # is reaped it may be reused, so nothing signals it after that
+        self._reap_lock = threading.Lock()
+    
+    @classmethod
+    def spawn(cls, argv, rows=24, cols=80):
+        """Fork argv onto a new pseudo-terminal as its session leader"""
+        pid, fd = pty.fork()
+        if pid == 0:
+            try:
+                fcntl.ioctl(0, termios.TIOCSWINSZ, struct.pack('HHHH', rows, cols, 0, 0))
+                os.execv(argv[0], argv)
+            finally:
+                os._exit(127)
+        return cls(pid, fd)
+    
+    def _reap(self, flags):
+        """waitpid the shell with flags and record its status; call with _reap_lock held"""
+        if self.exitstatus is None:
+            try:
+                pid, status = os.waitpid(self.pid, flags)
+            except ChildProcessError:
+                pid, status = self.pid, 0
+            if pid:
+                self.exitstatus = status
+        return self.exitstatus is None
+    
+    def isalive(self):
+        if self.exitstatus is not None:
+            return False
+        with self._reap_lock:
+            return self._reap(os.WNOHANG)
+    
+    def kill(self, sig):
+        with self._reap_lock:
+            if self._reap(os.WNOHANG):
+                os.kill(self.pid, sig)
+    
+    def setwinsize(self, rows, cols):
+        fcntl.ioctl(self.fd, termios.TIOCSWINSZ, struct.pack('HHHH', rows, cols, 0, 0))
+    
+    def close(self):
+        """Hang up the terminal; the caller makes sure no other thread is using the fd"""
+        if self.fd >= 0:
+            try:
+                os.close(self.fd)
+            except OSError:
+                pass
+            self.fd = -1
+    
+    def reap(self, timeout=1.0):
+        """Wait for the shell to exit, killing it if it hasn't within timeout"""
+        killer = threading.Timer(timeout, self.kill, (signal.SIGKILL,))
+        killer.daemon = True
+        killer.start()
+        try:
+            # WNOWAIT leaves the exited shell as a zombie, so kill's own check still sees its pid
+            os.waitid(os.P_PID, self.pid, os.WEXITED | os.WNOWAIT)
+        except ChildProcessError:
+            # The reader thread has reaped it already
+            pass
+        finally:
+            killer.cancel()
+        self.isalive()
 
 class VirtualTerminal:
     def __init__(self):
         self.user_terminals = {}  # user_id -> {terminal_id -> terminal_data}
+        self._by_id = {}  # terminal_id -> terminal_data, same records indexed for O(1) lookup
         self.terminal_counter = 0
+        # Single selector (epoll on Linux) watching every PTY; serviced by a background thread
+        self._selector = selectors.DefaultSelector()
+        # (loop, queue, output) deliveries collected by the reader thread during one select round
+        self._outbox = []
+        self._reader_thread = threading.Thread(target=self._reader_loop, daemon=True)
+        self._reader_thread.start()
+        # A few shells spawned ahead of time so create_terminal doesn't wait for fork/exec
+        self._shell_pool = queue.Queue(maxsize=2)
+        self._pool_thread = threading.Thread(target=self._refill_shell_pool, daemon=True)
+        self._pool_thread.start()
+        # Tasks forwarding output to subscribe_output callbacks, kept so they aren't garbage collected
+        self._subscriptions = set()
+        # Limits on what users can hold on to; main() sets them from the command line
+        self.max_terminals_per_user = 8
+        self.idle_timeout = 30 * 60  # seconds without input, output or reads before a terminal is closed
+        self._create_lock = threading.Lock()  # makes the per-user limit check and insert atomic
+        # Seconds a subscriber may go without output before it is sent an empty keepalive, so a client
+        # that went away is noticed and stops holding its terminal open against the idle reaper
+        self.subscriber_keepalive = 60
+    
+    def _refill_shell_pool(self):
+        """Keep the shell pool full, spawning a replacement whenever one is taken"""
+        while True:
+            try:
+                child = ShellPty.spawn(['/bin/bash'])
+            except Exception as e:
+                print(f"Failed to pre-spawn shell: {e}")
+                time.sleep(1)
+                continue
+            self._shell_pool.put(child)  # blocks while the pool is full
+    
+    def _take_shell(self):
+        """Hand out a pre-spawned shell, or spawn one now if none is ready and alive"""
+        try:
+            child = self._shell_pool.get_nowait()
+        except queue.Empty:
+            return ShellPty.spawn(['/bin/bash'])
+        if child.isalive():
+            return child
+        child.close()
+        return ShellPty.spawn(['/bin/bash'])
+    
+    def _reader_loop(self):
+        """Drain PTY output as soon as the kernel reports it ready"""
+        # Bound once; this loop runs for every burst of output from every terminal
+        select = self._selector.select
+        on_pty_ready = self._on_pty_ready
+        outbox = self._outbox
+        while True:
+            for key, _ in select():
+                on_pty_ready(key.fd, key.data)
+            if outbox:
+                self._flush_outbox()
+    
+    def _flush_outbox(self):
+        """Hand this round's subscriber output to each event loop with a single wakeup per loop"""
+        by_loop = {}
+        for loop, output_queue, output in self._outbox:
+            by_loop.setdefault(loop, []).append((output_queue, output))
+        self._outbox.clear()
+        for loop, deliveries in by_loop.items():
+            try:
+                loop.call_soon_threadsafe(self._deliver, deliveries)
+            except RuntimeError:
+                # The subscriber's loop has been closed
+                pass
+    
+    @staticmethod
+    def _deliver(deliveries):
+        for output_queue, output in deliveries:
+            output_queue.put_nowait(output)
+    
+    def _on_pty_ready(self, fd, terminal):
+        """Move available PTY output into the terminal buffers"""
+        # The PTY is non-blocking, so empty it on each readiness event. A short read means it
+        # is drained; anything arriving after that re-arms the level-triggered selector, so
+        # there is no need to pay for the extra read that would just raise BlockingIOError
+        read = os.read
+        chunks = []
+        closed = False
+        output_ready = terminal['output_ready']
+        with output_ready:
+            # close_terminal closes the fd under this lock, so the number can't be reused mid-read
+            if terminal['process'].fd != fd:
+                return
+            while True:
+                try:
+                    chunk = read(fd, 65536)
+                except BlockingIOError:
+                    break
+                except OSError:
+                    # EIO once the shell has exited and the slave side is closed
+                    chunk = b''
+                if not chunk:
+                    closed = True
+                    break
+                chunks.append(chunk)
+                if len(chunk) < 65536:
+                    break
+            
+            if closed:
+                # EOF (or hangup) - stop watching the PTY
+                self._unwatch_pty(terminal)
+            if chunks:
+                output = b''.join(chunks)
+                terminal['last_activity'] = time.monotonic()
+                if terminal['subscribers']:
+                    # Subscribers get output pushed to them instead of it waiting for a poll
+                    self._publish(terminal, output, self._outbox)
+                else:
+                    terminal['pending_output'].append(output)
+                    self._wake_readers(terminal)
+                # Store raw output in screen buffer for reconnection (oldest chunks drop off)
+                terminal['screen_buffer'].append(output)
+                output_ready.notify_all()
+            if closed:
+                self._publish(terminal, None, self._outbox)
+                output_ready.notify_all()
+        if closed:
+            # Reap the shell now if it has already exited, rather than on some later RPC
+            terminal['process'].isalive()
+    
+    def _publish(self, terminal, output, outbox=None):
+        """Hand output (None for end of output) to every subscriber's queue; call with output_ready held.
+        
+        The reader thread passes its outbox so deliveries are batched until the end of the select round.
+        """
+        if output is None:
+            terminal['output_closed'] = True
+            self._wake_readers(terminal)
+        for loop, output_queue in terminal['subscribers']:
+            if outbox is not None:
+                outbox.append((loop, output_queue, output))
+            else:
+                loop.call_soon_threadsafe(output_queue.put_nowait, output)
+    
+    def _wake_readers(self, terminal):
+        """Wake the long-polling reads waiting on this terminal; call with output_ready held"""
+        for loop, woken in terminal['readers']:
+            try:
+                loop.call_soon_threadsafe(woken.set)
+            except RuntimeError:
+                # The reader's loop has been closed
+                pass
+        terminal['readers'].clear()
+    
+    def _unwatch_pty(self, terminal):
+        """Stop watching a terminal's PTY output"""
+        try:
+            self._selector.unregister(terminal['process'].fd)
+        except (KeyError, ValueError):
+            pass
     
     def create_terminal(self, user_id):
+        with self._create_lock:
+            return self._create_terminal(user_id)
+    
+    def _create_terminal(self, user_id):
+        # Initialize user terminals if not exists
+        if user_id not in self.user_terminals:
+            self.user_terminals[user_id] = {}
+        if self.max_terminals_per_user and len(self.user_terminals[user_id]) >= self.max_terminals_per_user:
+            return {"error": f"Terminal limit reached ({self.max_terminals_per_user} per user)", "success": False}
+        
         terminal_id = f"terminal_{self.terminal_counter}"
         self.terminal_counter += 1
         
         # Create a new pseudo-terminal
-        child = ptyprocess.PtyProcess.spawn(['/bin/bash'])
+        child = self._take_shell()
         
-        # Initialize user terminals if not exists
-        if user_id not in self.user_terminals:
-            self.user_terminals[user_id] = {}
-        
-        self.user_terminals[user_id][terminal_id] = {
+        terminal = {
             'process': child,
             'created_at': time.time(),
+            'last_activity': time.monotonic(),  # last input, output or read; idle terminals get reaped
             'user_id': user_id,
-            'screen_buffer': []
+            'screen_buffer': collections.deque(maxlen=1000),  # last 1000 raw output chunks
+            'pending_output': [],  # raw PTY output not yet returned by read_from_terminal
+            'output_ready': threading.Condition(),  # guards the buffers, decoder and PTY reads, notified on new output
+            'decoder': codecs.getincrementaldecoder('utf-8')(errors='ignore'),  # carries split characters between reads
+            'write_queue': collections.deque(),  # input waiting for the thread that is writing
+            'write_lock': threading.Lock(),  # guards write_queue, writing and PTY writes
+            'writing': False,  # whether some thread is currently draining write_queue
+            'subscribers': [],  # (loop, asyncio.Queue) per subscribe_output caller; guarded by output_ready
+            'readers': [],  # (loop, asyncio.Event) per long-polling read_from_terminal_async; guarded by output_ready
+            'output_closed': False  # set once the PTY hits EOF or the terminal is closed
         }
+        self.user_terminals[user_id][terminal_id] = terminal
+        self._by_id[terminal_id] = terminal
+        os.set_blocking(child.fd, False)
+        self._selector.register(child.fd, selectors.EVENT_READ, terminal)
         
         return {"terminal_id": terminal_id, "success": True}
     
+    async def create_terminal_async(self, user_id):
+        """Create a terminal on a worker thread, since spawning a shell when the pool is empty blocks"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, self.create_terminal, user_id)
+    
     def _find_terminal(self, terminal_id, user_id=None):
         """Find terminal by ID, optionally restricted to a specific user"""
-        if user_id:
-            if user_id in self.user_terminals and terminal_id in self.user_terminals[user_id]:
-                return self.user_terminals[user_id][terminal_id]
-        else:
-            # Search across all users
-            for user_terminals in self.user_terminals.values():
-                if terminal_id in user_terminals:
-                    return user_terminals[terminal_id]
-        return None
+        terminal = self._by_id.get(terminal_id)
+        if terminal is None or (user_id and terminal['user_id'] != user_id):
+            return None
+        return terminal
     
     def write_to_terminal(self, terminal_id, command, user_id=None):
         terminal = self._find_terminal(terminal_id, user_id)
         if not terminal:
             return {"error": "Terminal not found", "success": False}
         
+        terminal['last_activity'] = time.monotonic()
         try:
-            terminal['process'].write(command.encode())
+            if self._queue_write(terminal, command):
+                self._drain_writes(terminal)
             return {"success": True}
         except Exception as e:
             return {"error": str(e), "success": False}
     
-    def read_from_terminal(self, terminal_id, user_id=None):
+    async def write_to_terminal_async(self, terminal_id, command, user_id=None):
+        """Write on the event loop while the PTY has room, finishing on a worker thread only if it fills up"""
         terminal = self._find_terminal(terminal_id, user_id)
         if not terminal:
             return {"error": "Terminal not found", "success": False}
         
+        terminal['last_activity'] = time.monotonic()
         try:
-            # Check if process is alive
-            if not terminal['process'].isalive():
-                return {"error": "Process not alive", "success": False}
-            
-            # Use select for non-blocking read
-            fd = terminal['process'].fd
-            ready, _, _ = select.select([fd], [], [], 0.1)  # 0.1 second timeout
-            
-            if ready:
-                try:
-                    output = os.read(fd, 1024)
-                    if output:
-                        decoded_output = output.decode('utf-8', errors='ignore')
-                        # Store output in screen buffer for reconnection
-                        terminal['screen_buffer'].append(decoded_output)
-                        # Keep buffer size reasonable (last 1000 lines)
-                        if len(terminal['screen_buffer']) > 1000:
-                            terminal['screen_buffer'] = terminal['screen_buffer'][-1000:]
-                        return {"output": decoded_output, "success": True}
-                except OSError:
-                    # No data available or connection closed
-                    pass
+            if self._queue_write(terminal, command) and not self._drain_writes(terminal, block=False):
+                loop = asyncio.get_running_loop()
+                await loop.run_in_executor(None, self._drain_writes, terminal)
+            return {"success": True}
+        except Exception as e:
+            return {"error": str(e), "success": False}
+    
+    def _queue_write(self, terminal, command):
+        """Queue command for the PTY, returning True if the caller has to drain the queue"""
+        # Binary payloads from the RPC layer go to the PTY as they are; only text needs encoding
+        data = command if isinstance(command, (bytes, bytearray)) else command.encode()
+        with terminal['write_lock']:
+            terminal['write_queue'].append(data)
+            if terminal['writing']:
+                # The thread already writing picks this up in its next batch
+                return False
+            terminal['writing'] = True
+            return True
+    
+    def _drain_writes(self, terminal, block=True):
+        """Write queued input until the queue is empty, one writev per batch.
+        
+        Without block, returns False as soon as the PTY is full, leaving the rest queued for the caller to finish.
+        """
+        process = terminal['process']
+        write_lock = terminal['write_lock']
+        write_queue = terminal['write_queue']
+        try:
+            while True:
+                with write_lock:
+                    if not write_queue:
+                        terminal['writing'] = False
+                        return True
+                    chunks = [write_queue.popleft() for _ in range(min(len(write_queue), 1024))]
+                
+                # The PTY is non-blocking; wait for room whenever its input queue is full
+                while chunks:
+                    # close_terminal closes the fd under write_lock, so never write to a stale fd number
+                    with write_lock:
+                        fd = process.fd
+                        if fd < 0:
+                            raise OSError(errno.EBADF, "Terminal is closed")
+                        try:
+                            written = os.writev(fd, chunks)
+                        except BlockingIOError:
+                            written = None
+                            if not block:
+                                write_queue.extendleft(reversed(chunks))
+                                return False
+                    if written is None:
+                        # Time out now and then to notice the terminal being closed meanwhile
+                        select.select([], [fd], [], 1)
+                        continue
+                    while chunks and written >= len(chunks[0]):
+                        written -= len(chunks.pop(0))
+                    if written:
+                        chunks[0] = chunks[0][written:]
+        except BaseException:
+            # Drop what is left so later writes aren't stuck behind a dead PTY
+            with terminal['write_lock']:
+                write_queue.clear()
+                terminal['writing'] = False
+            raise
+    
+    def read_from_terminal(self, terminal_id, user_id=None, timeout=0.1, binary=False):
+        """Return output collected since the last read; with binary, as the raw PTY bytes rather than text"""
+        terminal = self._find_terminal(terminal_id, user_id)
+        if not terminal:
+            return {"error": "Terminal not found", "success": False}
+        
+        terminal['last_activity'] = time.monotonic()
+        try:
+            # Hand over whatever the reader thread collected, waiting briefly if nothing yet;
+            # the reader's EOF flag stands in for asking the process on every call
+            output_ready = terminal['output_ready']
+            pending_output = terminal['pending_output']
+            with output_ready:
+                if not pending_output and timeout and not terminal['output_closed']:
+                    output_ready.wait(timeout)
+                output = b''.join(pending_output)
+                if not binary:
+                    output = terminal['decoder'].decode(output)
+                pending_output.clear()
+                output_closed = terminal['output_closed']
             
-            return {"output": "", "success": True}
+            # Output written before the shell exited is still handed over first
+            if output_closed and not output:
+                return {"error": "Process not alive", "success": False}
+            return {"output": output, "success": True}
         except Exception as e:
             return {"error": str(e), "success": False}
     
+    async def read_from_terminal_async(self, terminal_id, user_id=None, binary=False, wait=0.1):
+        """Hand over buffered output, waiting on the event loop for new output rather than on a thread.
+        
+        wait is how long to hold the call open for output when there is none yet, capped at 5 seconds.
+        """
+        result = self.read_from_terminal(terminal_id, user_id, timeout=0, binary=binary)
+        if not (result['success'] and not result['output'] and wait > 0):
+            return result
+        
+        terminal = self._find_terminal(terminal_id, user_id)
+        woken = asyncio.Event()
+        reader = (asyncio.get_running_loop(), woken)
+        with terminal['output_ready']:
+            # Output may have landed since the read above; the reader thread only wakes registered readers
+            if terminal['pending_output'] or terminal['output_closed']:
+                woken.set()
+            else:
+                terminal['readers'].append(reader)
+        try:
+            await asyncio.wait_for(woken.wait(), min(wait, 5.0))
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            with terminal['output_ready']:
+                if reader in terminal['readers']:
+                    terminal['readers'].remove(reader)
+        return self.read_from_terminal(terminal_id, user_id, timeout=0, binary=binary)
+    
+    async def subscribe_output(self, terminal_id, callback, user_id=None):
+        """Push the terminal's output to callback as it arrives, instead of the client polling for it"""
+        terminal = self._find_terminal(terminal_id, user_id)
+        if not terminal:
+            return {"error": "Terminal not found", "success": False}
+        
+        output_queue = asyncio.Queue()
+        subscriber = (asyncio.get_running_loop(), output_queue)
+        with terminal['output_ready']:
+            # Start with whatever is still waiting to be read, so nothing falls between the two
+            for output in terminal['pending_output']:
+                output_queue.put_nowait(output)
+            terminal['pending_output'].clear()
+            if terminal['output_closed']:
+                output_queue.put_nowait(None)
+            terminal['subscribers'].append(subscriber)
+        
+        task = asyncio.ensure_future(self._forward_output(terminal, subscriber, callback))
+        self._subscriptions.add(task)
+        task.add_done_callback(self._subscriptions.discard)
+        return {"success": True}
+    
+    async def _forward_output(self, terminal, subscriber, callback):
+        """Deliver queued output to a subscriber until the terminal ends or the callback fails"""
+        _, output_queue = subscriber
+        decoder = codecs.getincrementaldecoder('utf-8')(errors='ignore')
+        try:
+            while True:
+                try:
+                    chunks = [await asyncio.wait_for(output_queue.get(), self.subscriber_keepalive)]
+                except asyncio.TimeoutError:
+                    # Fails (and ends this subscription) if the client is gone
+                    await asyncio.wait_for(callback(""), self.subscriber_keepalive)
+                    continue
+                # Send everything that piled up during the last callback in one call
+                while not output_queue.empty():
+                    chunks.append(output_queue.get_nowait())
+                ended = None in chunks
+                output = decoder.decode(b''.join(chunk for chunk in chunks if chunk))
+                if output:
+                    await asyncio.wait_for(callback(output), self.subscriber_keepalive)
+                if ended:
+                    # None tells the client the terminal has ended, since it no longer polls to find out
+                    await asyncio.wait_for(callback(None), self.subscriber_keepalive)
+                    return
+        except Exception as e:
+            # Most likely the client went away
+            print(f"Stopped pushing terminal output: {e}")
+        finally:
+            with terminal['output_ready']:
+                terminal['subscribers'].remove(subscriber)
+    
     def close_terminal(self, terminal_id, user_id=None):
         terminal = self._find_terminal(terminal_id, user_id)
         if not terminal:
             return {"error": "Terminal not found", "success": False}
         
+        # Hang up now, with the reader and any writer locked out, so neither touches a reused fd number
+        with terminal['write_lock'], terminal['output_ready']:
+            self._unwatch_pty(terminal)
+            self._publish(terminal, None)
+            terminal['write_queue'].clear()
+            terminal['process'].close()
+        
         try:
             terminal['process'].kill(signal.SIGTERM)
         except:
             pass
+        # Reap the shell in the background rather than waiting for it here
+        threading.Thread(target=terminal['process'].reap, daemon=True).start()
         
-        # Remove from user's terminals
-        if user_id and user_id in self.user_terminals:
-            if terminal_id in self.user_terminals[user_id]:
-                del self.user_terminals[user_id][terminal_id]
-        else:
-            # Find and remove from any user
-            for user_terminals in self.user_terminals.values():
-                if terminal_id in user_terminals:
-                    del user_terminals[terminal_id]
-                    break
+        # Remove from user's terminals and the ID index
+        self._by_id.pop(terminal_id, None)
+        self.user_terminals[terminal['user_id']].pop(terminal_id, None)
         
         return {"success": True}
     
+    async def reap_idle_terminals(self, interval=60):
+        """Periodically close terminals nobody has used for idle_timeout seconds"""
+        while True:
+            await asyncio.sleep(interval)
+            if not self.idle_timeout:
+                continue
+            deadline = time.monotonic() - self.idle_timeout
+            for terminal_id, terminal in list(self._by_id.items()):
+                # A subscribed terminal has a client attached even when nothing is happening
+                if terminal['last_activity'] < deadline and not terminal['subscribers']:
+                    print(f"Closing idle terminal {terminal_id} of user {terminal['user_id']}")
+                    self.close_terminal(terminal_id)
+    
     def resize_terminal(self, terminal_id, rows, cols, user_id=None):
         terminal = self._find_terminal(terminal_id, user_id)
         if not terminal:
             return {"error": "Terminal not found", "success": False}
         
         try:
-            terminal['process'].setwinsize(rows, cols)
+            with terminal['output_ready']:
+                terminal['process'].setwinsize(rows, cols)
             return {"success": True}
         except Exception as e:
             return {"error": str(e), "success": False}
@@ -137,10 +559,7 @@ class VirtualTerminal:
                 return {"terminals": [], "success": True}
         else:
             # Return all terminals across all users (admin function)
-            all_terminals = []
-            for user_terminals in self.user_terminals.values():
-                all_terminals.extend(user_terminals.keys())
-            return {"terminals": all_terminals, "success": True}
+            return {"terminals": list(self._by_id), "success": True}
     
     def get_screen_content(self, terminal_id, user_id=None):
         terminal = self._find_terminal(terminal_id, user_id)
@@ -149,8 +568,9 @@ class VirtualTerminal:
         
         try:
             # Return the accumulated screen buffer
-            screen_content = ''.join(terminal['screen_buffer'])
-            return {"content": screen_content, "success": True}
+            with terminal['output_ready']:
+                screen_content = b''.join(terminal['screen_buffer'])
+            return {"content": screen_content.decode('utf-8', errors='ignore'), "success": True}
         except Exception as e:
             return {"error": str(e), "success": False}
 
@@ -164,22 +584,50 @@ app = FastAPI()
 terminal_service_id = None
 
 # Global variable to store authorized users
-authorized_users = set()
+authorized_users = frozenset()
 
-@app.get("/", response_class=HTMLResponse)
-async def serve_index():
+# Global variables to store the index page with the service ID injected, its gzip variant and ETag, built once
+index_html = None
+index_html_gzip = None
+index_etag = None
+
+# Access log entries queued by serve_static and printed by a background thread, off the request path
+access_log = queue.SimpleQueue()
+
+def print_access_log():
+    """Print queued access log entries as they arrive"""
+    while True:
+        user_id, client, method, path = access_log.get()
+        print(f'{user_id} - {client} - {method} - {path}')
+
+def render_index():
+    """Read index.html and inject the terminal service ID, or None if it is missing"""
     try:
-        with open("./index.html", "r") as f:
+        with open("./index.html", "rb") as f:
             html_content = f.read()
-            # Inject the terminal service ID into the HTML
-            if terminal_service_id:
-                html_content = html_content.replace(
-                    "{{TERMINAL_SERVICE_ID}}", 
-                    terminal_service_id
-                )
-            return html_content
     except FileNotFoundError:
-        return """
+        return None
+    # Inject the terminal service ID into the HTML
+    if terminal_service_id:
+        html_content = html_content.replace(b"{{TERMINAL_SERVICE_ID}}", terminal_service_id.encode())
+    return html_content
+
+def load_index():
+    """Render the index page, then precompress it and derive its ETag"""
+    global index_html, index_html_gzip, index_etag
+    index_html = render_index()
+    if index_html is not None:
+        index_html_gzip = gzip.compress(index_html, compresslevel=6)
+        # The ETag follows the content, so a new service ID after a restart is never served from cache
+        index_etag = b'"' + hashlib.md5(index_html).hexdigest().encode() + b'"'
+
+@app.get("/", response_class=HTMLResponse)
+async def serve_index():
+    if index_html is None:
+        load_index()
+    if index_html is not None:
+        return HTMLResponse(content=index_html)
+    return """
         <html>
         <head><title>Terminal Client Not Found</title></head>
         <body>
@@ -189,10 +637,38 @@ async def serve_index():
         </html>
         """
 
+async def send_index(scope, send):
+    """Answer a request for the index page: 304 if the client has it, gzipped if it accepts that"""
+    request_headers = dict(scope.get("headers") or ())
+    headers = [(b"etag", index_etag), (b"vary", b"accept-encoding")]
+    if index_etag in request_headers.get(b"if-none-match", b""):
+        await send({"type": "http.response.start", "status": 304, "headers": headers})
+        await send({"type": "http.response.body", "body": b""})
+        return
+    
+    if b"gzip" in request_headers.get(b"accept-encoding", b""):
+        body = index_html_gzip
+        headers.append((b"content-encoding", b"gzip"))
+    else:
+        body = index_html
+    headers.append((b"content-type", b"text/html; charset=utf-8"))
+    headers.append((b"content-length", str(len(body)).encode()))
+    await send({"type": "http.response.start", "status": 200, "headers": headers})
+    await send({"type": "http.response.body", "body": body if scope["method"] == "GET" else b""})
+
 async def serve_static(args, context=None):
     scope = args["scope"]
     if context:
-        print(f'{context["user"]["id"]} - {scope["client"]} - {scope["method"]} - {scope["path"]}')
+        access_log.put_nowait((context["user"]["id"], scope["client"], scope["method"], scope["path"]))
+    
+    # Answer the index page straight from the cache without going through FastAPI's routing
+    if scope["method"] in ("GET", "HEAD") and scope["path"] in ("/", ""):
+        if index_html is None:
+            load_index()
+        if index_html is not None:
+            await send_index(scope, args["send"])
+            return
+    
     await app(args["scope"], args["receive"], args["send"])
 
 async def main():
@@ -202,11 +678,17 @@ async def main():
     parser = argparse.ArgumentParser(description='Hypha Terminal Service')
     parser.add_argument('--authorized-emails', type=str, default='',
                         help='Comma-separated list of authorized email addresses')
+    parser.add_argument('--max-terminals-per-user', type=int, default=8,
+                        help='Maximum number of open terminals per user (0 for no limit)')
+    parser.add_argument('--idle-timeout', type=float, default=30,
+                        help='Minutes of inactivity after which a terminal is closed (0 to keep them open)')
     args = parser.parse_args()
+    terminal_manager.max_terminals_per_user = args.max_terminals_per_user
+    terminal_manager.idle_timeout = args.idle_timeout * 60
     
     # Parse authorized emails
     if args.authorized_emails:
-        authorized_users = set(email.strip() for email in args.authorized_emails.split(',') if email.strip())
+        authorized_users = frozenset(email.strip() for email in args.authorized_emails.split(',') if email.strip())
         print(f"Authorized users: {', '.join(authorized_users)}")
     else:
         print("No email restrictions - all authenticated users allowed")
@@ -219,32 +701,41 @@ async def main():
         pass
     
     # Service wrapper functions that extract user_id from context and check authorization
+    @functools.lru_cache(maxsize=4096)
+    def is_authorized(email):
+        """Memoised allow-list decision; the list is fixed once the service starts"""
+        return not authorized_users or email in authorized_users
+    
     def check_authorization(context):
         """Check if user is authorized based on email, raise exception if not"""
-        if not authorized_users:  # If no authorized users specified, allow all
+        user_email = context.get("user", {}).get("email") if context else None
+        if is_authorized(user_email):
             return
         
-        user_email = context.get("user", {}).get("email") if context else None
         if not user_email:
             raise AuthorizationError("No user email found in context")
-        
-        if user_email not in authorized_users:
-            raise AuthorizationError(f"Email '{user_email}' not in authorized users list")
+        raise AuthorizationError(f"Email '{user_email}' not in authorized users list")
     
-    def create_terminal_with_context(context=None):
+    # Handlers run on the event loop; the ones that can block hand off to a worker thread themselves
+    async def create_terminal_with_context(context=None):
         check_authorization(context)
         user_id = context.get("user", {}).get("id") if context else "anonymous"
-        return terminal_manager.create_terminal(user_id)
+        return await terminal_manager.create_terminal_async(user_id)
     
-    def write_to_terminal_with_context(terminal_id, command, context=None):
+    async def write_to_terminal_with_context(terminal_id, command, context=None):
         check_authorization(context)
         user_id = context.get("user", {}).get("id") if context else None
-        return terminal_manager.write_to_terminal(terminal_id, command, user_id)
+        return await terminal_manager.write_to_terminal_async(terminal_id, command, user_id)
     
-    def read_from_terminal_with_context(terminal_id, context=None):
+    async def read_from_terminal_with_context(terminal_id, binary=False, wait=0.1, context=None):
         check_authorization(context)
         user_id = context.get("user", {}).get("id") if context else None
-        return terminal_manager.read_from_terminal(terminal_id, user_id)
+        return await terminal_manager.read_from_terminal_async(terminal_id, user_id, binary, wait)
+    
+    async def subscribe_output_with_context(terminal_id, callback, context=None):
+        check_authorization(context)
+        user_id = context.get("user", {}).get("id") if context else None
+        return await terminal_manager.subscribe_output(terminal_id, callback, user_id)
     
     def close_terminal_with_context(terminal_id, context=None):
         check_authorization(context)
@@ -271,18 +762,22 @@ async def main():
         "id": "hypha-terminal-service",
         "name": "Hypha Virtual Terminal Service",
         "type": "rpc",
-        "config": {"visibility": "public", "require_context": True, "run_in_executor": True},
+        "config": {"visibility": "public", "require_context": True},
         "create_terminal": create_terminal_with_context,
         "write_to_terminal": write_to_terminal_with_context,
         "read_from_terminal": read_from_terminal_with_context,
+        "subscribe_output": subscribe_output_with_context,
         "close_terminal": close_terminal_with_context,
         "resize_terminal": resize_terminal_with_context,
         "list_terminals": list_terminals_with_context,
         "get_screen_content": get_screen_content_with_context,
     })
     
-    # Store the terminal service ID for injection into HTML
+    # Store the terminal service ID and bake it into the index page
     terminal_service_id = terminal_service.id
+    load_index()
+    threading.Thread(target=print_access_log, daemon=True).start()
+    reaper = asyncio.ensure_future(terminal_manager.reap_idle_terminals())
     
     # Register static file service
     static_service = await server.register_service({
@@ -300,4 +795,10 @@ async def main():
     await server.serve()
 
 if __name__ == "__main__":
+    # Run the service loop on uvloop when it is installed; the stdlib loop works the same, just slower
+    try:
+        import uvloop
+        uvloop.install()
+    except ImportError:
+        pass
     asyncio.run(main())
\ No newline at end of file
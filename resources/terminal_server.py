@@ -261,4 +261,10 @@ async def main():
     await server.serve()
 
 if __name__ == "__main__":
+    # Run the service loop on uvloop when it is installed; the stdlib loop works the same, just slower
+    try:
+        import uvloop
+        uvloop.install()
+    except ImportError:
+        pass
     asyncio.run(main())
\ No newline at end of file
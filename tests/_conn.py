@@ -0,0 +1,74 @@
+"""Shared Hypha server connection and terminal helpers for the test scripts, so each run does the handshake once"""
+import asyncio
+import contextlib
+from hypha_rpc import connect_to_server
+
+SERVER_URL = "https://hypha.aicell.io"
+
+# Extra connect_to_server options. RPCs are multiplexed over the one websocket, so concurrent calls
+# don't queue behind each other; method_timeout bounds how long any one of them can hang
+CONNECTION_CONFIG = {"method_timeout": 60}
+
+# server_url -> task connecting to it; concurrent callers wait on the same connection
+_connections = {}
+
+async def get_server(server_url=SERVER_URL):
+    """Connect to server_url the first time it is asked for and hand out that connection after"""
+    connection = _connections.get(server_url)
+    if connection is None:
+        connection = _connections[server_url] = asyncio.ensure_future(
+            connect_to_server({"server_url": server_url, **CONNECTION_CONFIG}))
+    try:
+        return await connection
+    except Exception:
+        # Let the next caller try again rather than caching the failure
+        _connections.pop(server_url, None)
+        raise
+
+# Full ID of the terminal service found by the last discovery in this process, reused while that service is still up
+_service_id = None
+
+async def resolve_terminal_service(server, timeout=5):
+    """Return (service_id, service) for the terminal service, or (None, None) if none is registered.
+    
+    Tries the ID found earlier in this run first and only lists the server's services when that is missing or stale.
+    """
+    global _service_id
+    cached_id = _service_id
+    if cached_id:
+        try:
+            return cached_id, await asyncio.wait_for(server.getService(cached_id), timeout)
+        except Exception:
+            # The service was restarted or removed since; look it up again
+            pass
+    
+    services = await server.list_services()
+    terminal_services = [s for s in services if 'hypha-terminal-service' in s.get('id', '')]
+    if not terminal_services:
+        return None, None
+    service_id = terminal_services[0]['id']
+    service = await server.getService(service_id)
+    _service_id = service_id
+    return service_id, service
+
+class TerminalError(Exception):
+    """A terminal service call answered with success False"""
+    pass
+
+@contextlib.asynccontextmanager
+async def open_terminal(terminal_service):
+    """Create a terminal for the duration of the block and close it afterwards, even if the block fails"""
+    result = await terminal_service.create_terminal()
+    if not result.get('success'):
+        raise TerminalError(result.get('error', 'Unknown error'))
+    terminal_id = result['terminal_id']
+    try:
+        yield terminal_id
+    finally:
+        await terminal_service.close_terminal(terminal_id)
+
+async def run_command(terminal_service, terminal_id, command, wait=0.5):
+    """Send command, give it wait seconds to run and return the read_from_terminal result"""
+    await terminal_service.write_to_terminal(terminal_id, command + "\n")
+    await asyncio.sleep(wait)
+    return await terminal_service.read_from_terminal(terminal_id)
@@ -0,0 +1,21 @@
+#!/usr/bin/env python3
+"""
+Run the terminal service test scripts together on one event loop and one server connection
+
+Usage:
+    python tests/run_all.py
+"""
+import asyncio
+import sys
+from _conn import get_server
+from test_setup import test_terminal_service
+from test_terminal import test_terminal
+
+async def main():
+    # Connect once up front; both tests then share that connection and overlap their RPC waits
+    server = await get_server()
+    _, service_ok = await asyncio.gather(test_terminal(server), test_terminal_service(server))
+    sys.exit(0 if service_ok else 1)
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -13,23 +13,65 @@ Examples:
     python test_client.py interactive
 """
 import asyncio
+import functools
+import re
 import sys
 import time
-from hypha_rpc import connect_to_server
+from _conn import SERVER_URL, get_server, resolve_terminal_service
+
+def rpc_test(action, activity):
+    """Turn a method returning a terminal service result into a test step returning True or False.
+    
+    The method reports its own success; failures, exceptions and calls taking longer than the
+    client's rpc_timeout are reported here, e.g. "Failed to <action>" and "Exception during <activity>".
+    """
+    def decorator(method):
+        @functools.wraps(method)
+        async def wrapper(self, *args, **kwargs):
+            try:
+                result = await asyncio.wait_for(method(self, *args, **kwargs), self.rpc_timeout)
+                if result.get('success'):
+                    return True
+                print(f"❌ Failed to {action}: {result.get('error', 'Unknown error')}")
+                return False
+            except asyncio.TimeoutError:
+                print(f"❌ Timed out after {self.rpc_timeout}s during {activity}")
+                return False
+            except Exception as e:
+                print(f"❌ Exception during {activity}: {e}")
+                return False
+        return wrapper
+    return decorator
 
 class TerminalTestClient:
-    def __init__(self, server_url="https://hypha.aicell.io", service_id=None):
+    # A shell prompt at the end of the output, after at least one full line: the command has finished
+    PROMPT_RE = re.compile(r"\n.*[$#] *$")
+    # Printed once a batch of commands has run; the quotes stop the echoed command line itself from matching
+    BATCH_DONE_COMMAND = "echo batch' 'done"
+    BATCH_DONE_RE = re.compile(r"^batch done\r?$", re.MULTILINE)
+    # How much of the end of the output to match those against; enough for the last few lines
+    MATCH_TAIL = 1024
+    
+    def __init__(self, server_url=SERVER_URL, service_id=None, server=None, rpc_timeout=10.0):
         self.server_url = server_url
         self.service_id = service_id
-        self.server = None
+        self.server = server  # an existing connection to reuse, if the caller has one
+        self.rpc_timeout = rpc_timeout  # longest any single test step's RPC may take
         self.terminal_service = None
         self.current_terminal_id = None
+        self.listed_terminals = []  # terminal IDs from the last test_list_terminals
+        # Output pushed by the service once subscribed, instead of polling read_from_terminal
+        self.subscribed = False
+        self.output_chunks = []
+        self.output_event = None
+        self.long_poll = True  # whether read_from_terminal takes binary and wait; cleared if the service refuses them
     
     async def connect(self):
         """Connect to Hypha server and get terminal service"""
         try:
             print(f"🔌 Connecting to Hypha server: {self.server_url}")
-            self.server = await connect_to_server({"server_url": self.server_url})
+            if self.server is None:
+                self.server = await get_server(self.server_url)
             print(f"✅ Connected to server")
             
             # If service ID is provided, use it directly
@@ -49,21 +91,16 @@ class TerminalTestClient:
                     print(f"✅ Got terminal service directly")
                 except Exception as e:
                     print(f"⚠️  Direct service access failed: {e}")
-                    print("📋 Listing services...")
+                    print("📋 Looking up the terminal service...")
                     try:
-                        services = await self.server.list_services()
-                        print(f"📝 Available services: {[s.get('id', s) for s in services]}")
-                        terminal_services = [s for s in services if 'hypha-terminal-service' in s.get('id', '')]
+                        service_id, self.terminal_service = await resolve_terminal_service(self.server)
                         
-                        if not terminal_services:
+                        if not service_id:
                             print("❌ No terminal service found.")
                             print("💡 Please provide the service ID manually using: python test_client.py <service_id>")
                             return False
                         
-                        service_id = terminal_services[0]['id']
                         print(f"🎯 Found terminal service: {service_id}")
-                        
-                        self.terminal_service = await self.server.getService(service_id)
                     except Exception as e2:
                         print(f"❌ Service discovery failed: {e2}")
                         print("💡 Please provide the service ID manually using: python test_client.py <service_id>")
@@ -75,111 +112,172 @@ class TerminalTestClient:
             print(f"❌ Connection failed: {e}")
             return False
     
+    @rpc_test("create terminal", "terminal creation")
     async def test_create_terminal(self):
         """Test creating a new terminal"""
         print("\n🧪 Testing terminal creation...")
-        try:
-            result = await self.terminal_service.create_terminal()
-            if result.get('success'):
-                self.current_terminal_id = result['terminal_id']
-                print(f"✅ Created terminal: {self.current_terminal_id}")
-                return True
-            else:
-                print(f"❌ Failed to create terminal: {result.get('error', 'Unknown error')}")
-                return False
-        except Exception as e:
-            print(f"❌ Exception during terminal creation: {e}")
-            return False
+        result = await self.terminal_service.create_terminal()
+        if result.get('success'):
+            self.current_terminal_id = result['terminal_id']
+            print(f"✅ Created terminal: {self.current_terminal_id}")
+            await self.subscribe_output()
+        return result
     
+    @rpc_test("send command", "command send")
     async def test_write_command(self, command):
         """Test writing a command to terminal"""
         print(f"\n🧪 Testing command: {command}")
+        result = await self.terminal_service.write_to_terminal(self.current_terminal_id, command + '\n')
+        if result.get('success'):
+            print(f"✅ Command sent successfully")
+        return result
+    
+    async def subscribe_output(self):
+        """Have the service push the terminal's output as it is produced, falling back to polling"""
+        self.output_chunks = []
+        self.output_event = asyncio.Event()
+        
+        async def on_output(output):
+            # None marks the end of the terminal's output
+            if output is not None:
+                self.output_chunks.append(output)
+            self.output_event.set()
+        
         try:
-            result = await self.terminal_service.write_to_terminal(self.current_terminal_id, command + '\n')
-            if result.get('success'):
-                print(f"✅ Command sent successfully")
-                return True
-            else:
-                print(f"❌ Failed to send command: {result.get('error', 'Unknown error')}")
-                return False
+            result = await self.terminal_service.subscribe_output(self.current_terminal_id, on_output)
+            self.subscribed = bool(result.get('success'))
         except Exception as e:
-            print(f"❌ Exception during command send: {e}")
-            return False
+            print(f"⚠️  Output subscription unavailable, polling instead: {e}")
+            self.subscribed = False
+        return self.subscribed
     
-    async def test_read_output(self, max_attempts=10):
-        """Test reading output from terminal"""
+    async def test_read_output(self, timeout=2.0, idle_threshold=0.15, until=None):
+        """Test reading output from terminal, until it matches until (the prompt by default), goes quiet or timeout passes"""
         print(f"\n🧪 Testing output reading...")
-        output_collected = ""
+        until = until or self.PROMPT_RE
+        if self.subscribed:
+            return await self.wait_for_output(timeout, until)
+        # Chunks are joined once at the end; matching only looks at the tail, so both stay linear
+        chunks = []
+        tail = ""
+        deadline = time.monotonic() + timeout
+        attempt = 0
         
-        for attempt in range(max_attempts):
+        while time.monotonic() < deadline:
+            attempt += 1
+            # The service holds each read open until output arrives: up to the deadline for the
+            # first output, then idle_threshold for more, so no sleeping between reads
+            wait = idle_threshold if chunks else deadline - time.monotonic()
             try:
-                result = await self.terminal_service.read_from_terminal(self.current_terminal_id)
+                # The read is held open for up to wait on purpose; only time beyond that counts against rpc_timeout
+                result = await asyncio.wait_for(self.read_once(wait), wait + self.rpc_timeout)
                 if result.get('success'):
                     output = result.get('output', '')
                     if output:
-                        output_collected += output
-                        print(f"📤 Output chunk {attempt + 1}: {repr(output)}")
+                        chunks.append(output)
+                        tail = (tail + output)[-self.MATCH_TAIL:]
+                        print(f"📤 Output chunk {attempt}: {repr(output)}")
+                        if until.search(tail):
+                            break
+                    elif chunks:
+                        # Nothing more within idle_threshold: the command is done
+                        break
                     else:
-                        print(f"📭 No output (attempt {attempt + 1})")
+                        print(f"📭 No output (attempt {attempt})")
                 else:
                     print(f"❌ Failed to read output: {result.get('error', 'Unknown error')}")
                     return False
+            except asyncio.TimeoutError:
+                print(f"❌ Timed out after {self.rpc_timeout}s during output read")
+                return False
             except Exception as e:
                 print(f"❌ Exception during output read: {e}")
                 return False
-            
-            # Wait a bit between reads
-            await asyncio.sleep(0.2)
         
-        print(f"✅ Total output collected: {repr(output_collected)}")
+        print(f"✅ Total output collected: {repr(''.join(chunks))}")
         return True
     
+    async def read_once(self, wait):
+        """Make one read_from_terminal call, held open up to wait seconds on services that support it"""
+        if self.long_poll:
+            try:
+                return await self.terminal_service.read_from_terminal(self.current_terminal_id, False, wait)
+            except Exception as e:
+                # Services from before the binary and wait arguments reject them; read the old way from now on
+                print(f"⚠️  Long-poll read unavailable, falling back to plain reads: {e}")
+                self.long_poll = False
+        return await self.terminal_service.read_from_terminal(self.current_terminal_id)
+    
+    async def wait_for_output(self, timeout=2.0, until=None):
+        """Collect pushed output until it matches until (the shell prompt by default) or timeout passes"""
+        until = until or self.PROMPT_RE
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        chunks = []
+        tail = ""
+        while True:
+            remaining = deadline - loop.time()
+            try:
+                await asyncio.wait_for(self.output_event.wait(), remaining)
+            except asyncio.TimeoutError:
+                break
+            self.output_event.clear()
+            output = "".join(self.output_chunks)
+            self.output_chunks.clear()
+            print(f"📤 Output chunk: {repr(output)}")
+            chunks.append(output)
+            tail = (tail + output)[-self.MATCH_TAIL:]
+            if until.search(tail):
+                break
+        
+        print(f"✅ Total output collected: {repr(''.join(chunks))}")
+        return True
+    
+    @rpc_test("send commands", "command send")
+    async def test_write_batch(self, commands):
+        """Test sending several commands in one write, followed by the batch-done marker"""
+        print(f"\n🧪 Testing commands: {commands}")
+        data = "".join(command + "\n" for command in commands) + self.BATCH_DONE_COMMAND + "\n"
+        result = await self.terminal_service.write_to_terminal(self.current_terminal_id, data)
+        if result.get('success'):
+            print(f"✅ Commands sent successfully")
+        return result
+    
+    async def exec_and_collect(self, command, timeout=2.0):
+        """Send a command and read its output in one step, the read going out while the write is in flight"""
+        sent, read = await asyncio.gather(
+            self.test_write_command(command), self.test_read_output(timeout), return_exceptions=True)
+        return sent is True and read is True
+    
+    @rpc_test("resize terminal", "terminal resize")
     async def test_terminal_resize(self, rows=25, cols=80):
         """Test terminal resize functionality"""
         print(f"\n🧪 Testing terminal resize to {rows}x{cols}...")
-        try:
-            result = await self.terminal_service.resize_terminal(self.current_terminal_id, rows, cols)
-            if result.get('success'):
-                print(f"✅ Terminal resized successfully")
-                return True
-            else:
-                print(f"❌ Failed to resize terminal: {result.get('error', 'Unknown error')}")
-                return False
-        except Exception as e:
-            print(f"❌ Exception during terminal resize: {e}")
-            return False
+        result = await self.terminal_service.resize_terminal(self.current_terminal_id, rows, cols)
+        if result.get('success'):
+            print(f"✅ Terminal resized successfully")
+        return result
     
+    @rpc_test("list terminals", "terminal listing")
     async def test_list_terminals(self):
         """Test listing terminals"""
         print(f"\n🧪 Testing terminal listing...")
-        try:
-            result = await self.terminal_service.list_terminals()
-            if result.get('success'):
-                terminals = result.get('terminals', [])
-                print(f"✅ Found {len(terminals)} terminals: {terminals}")
-                return True
-            else:
-                print(f"❌ Failed to list terminals: {result.get('error', 'Unknown error')}")
-                return False
-        except Exception as e:
-            print(f"❌ Exception during terminal listing: {e}")
-            return False
+        result = await self.terminal_service.list_terminals()
+        if result.get('success'):
+            self.listed_terminals = result.get('terminals', [])
+            print(f"✅ Found {len(self.listed_terminals)} terminals: {self.listed_terminals}")
+        return result
     
+    @rpc_test("close terminal", "terminal closure")
     async def test_close_terminal(self):
         """Test closing terminal"""
         print(f"\n🧪 Testing terminal closure...")
-        try:
-            result = await self.terminal_service.close_terminal(self.current_terminal_id)
-            if result.get('success'):
-                print(f"✅ Terminal closed successfully")
-                self.current_terminal_id = None
-                return True
-            else:
-                print(f"❌ Failed to close terminal: {result.get('error', 'Unknown error')}")
-                return False
-        except Exception as e:
-            print(f"❌ Exception during terminal closure: {e}")
-            return False
+        result = await self.terminal_service.close_terminal(self.current_terminal_id)
+        if result.get('success'):
+            print(f"✅ Terminal closed successfully")
+            self.current_terminal_id = None
+            self.subscribed = False
+        return result
     
     async def run_comprehensive_test(self):
         """Run comprehensive test suite"""
@@ -189,45 +287,33 @@ class TerminalTestClient:
         if not await self.connect():
             return False
         
-        # Test create terminal
-        if not await self.test_create_terminal():
-            return False
-        
-        # Test list terminals
-        if not await self.test_list_terminals():
-            return False
-        
-        # Test resize
-        if not await self.test_terminal_resize():
-            return False
-        
-        # Test basic command
-        if not await self.test_write_command("echo 'Hello World'"):
+        # Test create and list terminals together; listing doesn't need the new terminal's ID
+        results = await asyncio.gather(self.test_create_terminal(), self.test_list_terminals(), return_exceptions=True)
+        if not all(result is True for result in results):
             return False
         
-        # Wait a bit for command to process
-        await asyncio.sleep(1)
-        
-        # Test read output
-        if not await self.test_read_output():
-            return False
-        
-        # Test another command
-        if not await self.test_write_command("pwd"):
-            return False
-        
-        # Wait and read again
-        await asyncio.sleep(1)
-        if not await self.test_read_output():
-            return False
+        # The listing may have been answered before the terminal existed; if so, list again
+        if self.current_terminal_id not in self.listed_terminals:
+            if not await self.test_list_terminals() or self.current_terminal_id not in self.listed_terminals:
+                print(f"❌ New terminal {self.current_terminal_id} missing from the terminal list")
+                return False
         
-        # Test interactive command
-        if not await self.test_write_command("ls -la"):
+        # Test resize and a basic command with its output together; neither depends on the other
+        results = await asyncio.gather(
+            self.test_terminal_resize(),
+            self.exec_and_collect("echo 'Hello World'"),
+            return_exceptions=True,
+        )
+        if not all(result is True for result in results):
             return False
         
-        # Wait and read again
-        await asyncio.sleep(1)
-        if not await self.test_read_output():
+        # Test another command and an interactive one, sent in a single write and read back together
+        results = await asyncio.gather(
+            self.test_write_batch(["pwd", "ls -la"]),
+            self.test_read_output(until=self.BATCH_DONE_RE),
+            return_exceptions=True,
+        )
+        if not all(result is True for result in results):
             return False
         
         # Test close terminal
@@ -237,6 +323,25 @@ class TerminalTestClient:
         print("\n🎉 All tests passed successfully!")
         return True
     
+    async def read_line(self, prompt):
+        """Read a line from stdin while the event loop keeps running, without a thread parked in input()"""
+        print(prompt, end="", flush=True)
+        loop = asyncio.get_running_loop()
+        line = loop.create_future()
+        
+        def on_readable():
+            if not line.done():
+                line.set_result(sys.stdin.readline())
+        
+        loop.add_reader(sys.stdin.fileno(), on_readable)
+        try:
+            text = await line
+        finally:
+            loop.remove_reader(sys.stdin.fileno())
+        if not text:
+            raise EOFError
+        return text.rstrip("\n")
+    
     async def interactive_test(self):
         """Interactive test mode"""
         print("🎮 Starting interactive test mode...")
@@ -249,28 +354,30 @@ class TerminalTestClient:
         
         print("\n📝 Interactive mode - type commands (type 'exit' to quit):")
         
-        while True:
-            try:
-                command = input("$ ")
-                if command.lower() in ['exit', 'quit']:
+        try:
+            while True:
+                try:
+                    command = await self.read_line("$ ")
+                    if command.lower() in ['exit', 'quit']:
+                        break
+                    
+                    # Send command
+                    await self.test_write_command(command)
+                    
+                    # Read output until it settles
+                    await self.test_read_output()
+                    
+                except EOFError:
                     break
-                
-                # Send command
-                await self.test_write_command(command)
-                
-                # Wait and read output
-                await asyncio.sleep(0.5)
-                await self.test_read_output(max_attempts=5)
-                
-            except KeyboardInterrupt:
-                print("\n\n⚠️  Interrupted by user")
-                break
-            except Exception as e:
-                print(f"❌ Error: {e}")
-        
-        # Clean up
-        if self.current_terminal_id:
-            await self.test_close_terminal()
+                except Exception as e:
+                    print(f"❌ Error: {e}")
+        except (KeyboardInterrupt, asyncio.CancelledError):
+            # Ctrl-C arrives as a cancellation of this task under asyncio.run
+            print("\n\n⚠️  Interrupted by user")
+        finally:
+            # Clean up
+            if self.current_terminal_id:
+                await self.test_close_terminal()
         
         print("👋 Interactive mode ended")
 
@@ -2,47 +2,43 @@
 import asyncio
 import sys
 import subprocess
-import time
 
-async def test_terminal_service():
-    """Test the terminal service functionality"""
+# Imported once up front; check_dependencies reports the missing package if this fails
+try:
+    from _conn import get_server, resolve_terminal_service, open_terminal, run_command
+    hypha_rpc_available = True
+except ImportError:
+    hypha_rpc_available = False
+
+async def test_terminal_service(server=None):
+    """Test the terminal service functionality, on the given server connection or the shared one"""
     try:
-        from hypha_rpc import connect_to_server
+        if not hypha_rpc_available:
+            raise ImportError("hypha_rpc is not installed")
         
         print("Testing terminal service...")
-        server = await connect_to_server({"server_url": "https://hypha.aicell.io"})
+        if server is None:
+            server = await get_server()
         
-        # List services to find our terminal service
-        services = await server.listServices()
-        terminal_services = [s for s in services if 'hypha-terminal-service' in s.get('id', '')]
+        # Find our terminal service, from the cached ID when it is still valid
+        service_id, terminal_service = await resolve_terminal_service(server)
         
-        if not terminal_services:
+        if not service_id:
             print("❌ Terminal service not found. Make sure hypha-terminal.py is running.")
             return False
             
-        service_id = terminal_services[0]['id']
         print(f"✅ Found terminal service: {service_id}")
         
-        # Test the service
-        terminal_service = await server.getService(service_id)
-        
-        # Create terminal
-        result = await terminal_service.create_terminal()
-        if result.get('success'):
-            terminal_id = result['terminal_id']
+        # Create terminal, closed again when the block ends
+        async with open_terminal(terminal_service) as terminal_id:
             print(f"✅ Created terminal: {terminal_id}")
             
-            # Test command
-            await terminal_service.write_to_terminal(terminal_id, "echo 'Hello from test'\\n")
-            time.sleep(0.5)
-            
-            output = await terminal_service.read_from_terminal(terminal_id)
+            # Test command, waiting on the event loop rather than blocking it
+            output = await run_command(terminal_service, terminal_id, "echo 'Hello from test'", wait=0.5)
             if output.get('success'):
                 print(f"✅ Command output: {output.get('output', '').strip()}")
             
-            # Close terminal
-            await terminal_service.close_terminal(terminal_id)
-            print("✅ Terminal closed successfully")
+        print("✅ Terminal closed successfully")
             
         return True
         
@@ -52,14 +48,15 @@ async def test_terminal_service():
 
 def check_dependencies():
     """Check if required dependencies are installed"""
-    required = ['hypha_rpc', 'ptyprocess', 'fastapi']
+    # (pip package name, import name)
+    required = [('hypha-rpc', 'hypha_rpc'), ('ptyprocess', 'ptyprocess'), ('fastapi', 'fastapi')]
     missing = []
     
-    for dep in required:
+    for package, module in required:
         try:
-            __import__(dep.replace('_', '-'))
+            __import__(module)
         except ImportError:
-            missing.append(dep)
+            missing.append(package)
     
     if missing:
         print(f"❌ Missing dependencies: {', '.join(missing)}")
@@ -1,32 +1,24 @@
 import asyncio
-from hypha_rpc import connect_to_server
+from _conn import get_server, open_terminal, run_command
 
-async def test_terminal():
+async def test_terminal(server=None):
     try:
-        # Connect to server
-        server = await connect_to_server({"server_url": "https://hypha.aicell.io"})
+        # Connect to server, reusing the shared connection unless one is passed in
+        if server is None:
+            server = await get_server()
         print("Connected to Hypha server")
         
         # Get the terminal service
         terminal_service = await server.get_service("terminal-service")
         print("Got terminal service")
         
-        # Create a terminal
-        result = await terminal_service.create_terminal()
-        terminal_id = result["terminal_id"]
-        print(f"Created terminal: {terminal_id}")
-        
-        # Send a command
-        await terminal_service.write_to_terminal(terminal_id, "echo 'Hello World'\n")
-        print("Sent command")
-        
-        # Read output
-        await asyncio.sleep(1)  # Wait for command to execute
-        output = await terminal_service.read_from_terminal(terminal_id)
-        print(f"Output: {output}")
-        
-        # Close terminal
-        await terminal_service.close_terminal(terminal_id)
+        # Create a terminal, closed again when the block ends
+        async with open_terminal(terminal_service) as terminal_id:
+            print(f"Created terminal: {terminal_id}")
+            
+            # Send a command and read its output once it has had a second to run
+            output = await run_command(terminal_service, terminal_id, "echo 'Hello World'", wait=1)
+            print(f"Output: {output}")
         print("Terminal closed")
         
     except Exception as e: